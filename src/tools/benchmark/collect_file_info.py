@@ -0,0 +1,72 @@
+"""collect_file_info (one stat, columnar arrays) against the old per-row DataFrame growth
+
+usage (from src/): python -m tools.benchmark.collect_file_info [--counts 10000,100000,1000000] [--legacy-max 10000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from ..core.duplicate_file_removal_tool import collect_file_info
+
+
+def legacy_collect_file_info(file_list):
+    # the previous implementation, df.append was removed in pandas 2 so a one-row concat stands in for it
+    df = pd.DataFrame(columns=['file_path', 'file_size', 'create_date', 'modify_date'])
+    for file_path in file_list:
+        file_size = os.path.getsize(file_path)
+        if os.path.isdir(file_path) or file_size == 0:
+            continue
+        create_date = os.path.getctime(file_path)
+        modify_date = os.path.getmtime(file_path)
+        row = pd.DataFrame([{
+            'file_path': file_path,
+            'file_size': file_size,
+            'create_date': create_date,
+            'modify_date': modify_date
+        }])
+        df = row if len(df) == 0 else pd.concat([df, row], ignore_index=True)
+    return df
+
+
+def make_files(root, count, per_dir=1000):
+    file_list = []
+    for i in range(count):
+        sub_dir = os.path.join(root, f'{i // per_dir:05d}')
+        if i % per_dir == 0:
+            os.makedirs(sub_dir)
+        file_path = os.path.join(sub_dir, f'{i}.bin')
+        with open(file_path, 'wb') as f:
+            f.write(b'x' * (1 + i % 4096))
+        file_list.append(file_path)
+    return file_list
+
+
+def timed(func, file_list):
+    start = time.perf_counter()
+    df = func(file_list)
+    return time.perf_counter() - start, len(df)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='10000,100000,1000000')
+    parser.add_argument('--legacy-max', type=int, default=10000, help='skip the quadratic version above this count')
+    args = parser.parse_args(argv)
+
+    print(f'{"files":>10} {"columnar s":>12} {"files/s":>12} {"legacy s":>12}')
+    for count in [int(x) for x in args.counts.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            file_list = make_files(tmp, count)
+            elapsed, rows = timed(collect_file_info, file_list)
+            assert rows == count
+            legacy = f'{"skipped":>12}'
+            if count <= args.legacy_max:
+                legacy = f'{timed(legacy_collect_file_info, file_list)[0]:>12.2f}'
+            print(f'{count:>10} {elapsed:>12.2f} {count / elapsed:>12.0f} {legacy}')
+
+
+if __name__ == '__main__':
+    main()
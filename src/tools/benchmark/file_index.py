@@ -0,0 +1,56 @@
+"""memory per file: FileIndex against a list of FileRecords and the file info DataFrame
+
+usage (from src/): python -m tools.benchmark.file_index [--counts 100000,1000000] [--per-dir 1000]
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from ..core.duplicate_file_removal_tool import file_info_from_records
+from ..core.file_index import FileIndex
+from ..core.walker import FileRecord
+
+
+def make_records(count, per_dir=1000):
+    # synthetic walker output, no files are created
+    for i in range(count):
+        mtime_ns = 1600000000 * 10**9 + i * 1000
+        yield FileRecord(f'/data/archive/{i // per_dir // 100:03d}/{i // per_dir:06d}/IMG_{i:08d}.jpg', 1 + i % 65536,
+                         1000000 + i, 2049, mtime_ns / 1e9, mtime_ns / 1e9, mtime_ns)
+
+
+def measure(build):
+    # memory still held by the result once it is built, and the peak while building it
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='100000,1000000')
+    parser.add_argument('--per-dir', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    candidates = [
+        ('FileRecord list', lambda count: list(make_records(count, args.per_dir))),
+        ('DataFrame', lambda count: file_info_from_records(list(make_records(count, args.per_dir)))),
+        ('FileIndex', lambda count: FileIndex.from_records(make_records(count, args.per_dir))),
+    ]
+
+    print(f'{"files":>10} {"storage":<16} {"bytes/file":>11} {"peak/file":>10} {"build s":>8}')
+    for count in [int(x) for x in args.counts.split(',')]:
+        for name, build in candidates:
+            current, peak, elapsed = measure(lambda: build(count))
+            print(f'{count:>10} {name:<16} {current / count:>11.1f} {peak / count:>10.1f} {elapsed:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
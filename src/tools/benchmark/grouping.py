@@ -0,0 +1,94 @@
+"""candidate bucketing: groupby().filter(lambda) against duplicated(keep=False) and the numpy sort in grouping.py
+
+usage (from src/): python -m tools.benchmark.grouping [--counts 100000,1000000] [--distinct 0.5] [--repeat 3]
+"""
+import argparse
+import hashlib
+import time
+
+import numpy as np
+import pandas as pd
+
+from ..core.grouping import digest_keys, duplicated_mask, shared_buckets
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def make_sizes(count, distinct, seed=0):
+    # about distinct * count different sizes, so most of them occur once and the rest a few times
+    rng = np.random.default_rng(seed)
+    return rng.integers(1, max(int(count * distinct), 2) * 4, size=count, dtype=np.int64)
+
+
+def make_digests(sizes):
+    return [hashlib.blake2b(str(file_size).encode()).hexdigest() for file_size in sizes.tolist()]
+
+
+def legacy_filter(df, column):
+    return df.groupby(column).filter(lambda group: len(group) > 1)
+
+
+def mask_filter(df, column):
+    return df[df.duplicated(column, keep=False)]
+
+
+def numpy_buckets(df, column):
+    return shared_buckets(df[column].to_numpy())
+
+
+def dict_digest_groups(sizes, digests):
+    groups = {}
+    for i, key in enumerate(zip(sizes, digests)):
+        groups.setdefault(key, []).append(i)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def keyed_digest_groups(sizes, digests):
+    return shared_buckets(digest_keys(sizes, digests))[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--counts', default='100000,1000000')
+    parser.add_argument('--distinct', type=float, default=0.5, help='distinct sizes per file')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f'{"files":>10} {"method":<34} {"best s":>8} {"speedup":>8}')
+    for count in [int(x) for x in args.counts.split(',')]:
+        sizes = make_sizes(count, args.distinct)
+        df = pd.DataFrame({'file_size': sizes})
+        baseline = best_of(args.repeat, legacy_filter, df, 'file_size')
+        assert mask_filter(df, 'file_size').index.equals(legacy_filter(df, 'file_size').index)
+        assert duplicated_mask(sizes).sum() == len(legacy_filter(df, 'file_size'))
+        for name, elapsed in [
+            ('sizes: groupby().filter(lambda)', baseline),
+            ('sizes: duplicated(keep=False)', best_of(args.repeat, mask_filter, df, 'file_size')),
+            ('sizes: argsort + unique', best_of(args.repeat, numpy_buckets, df, 'file_size')),
+        ]:
+            print(f'{count:>10} {name:<34} {elapsed:>8.3f} {baseline / elapsed:>7.1f}x')
+
+        # digests: the same value distribution, one digest per size
+        digests = make_digests(sizes)
+        size_list = sizes.tolist()
+        df['digest'] = digests
+        baseline = best_of(args.repeat, legacy_filter, df, 'digest')
+        assert len(keyed_digest_groups(size_list, digests)) == len(dict_digest_groups(size_list, digests))
+        for name, elapsed in [
+            ('digests: groupby().filter(lambda)', baseline),
+            ('digests: dict of hex strings', best_of(args.repeat, dict_digest_groups, size_list, digests)),
+            ('digests: fixed-width byte keys', best_of(args.repeat, keyed_digest_groups, size_list, digests)),
+        ]:
+            print(f'{count:>10} {name:<34} {elapsed:>8.3f} {baseline / elapsed:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""throughput (MB/s) of every registered hash backend on this machine
+
+usage (from src/): python -m tools.benchmark.hash_backends [--size-mb 256] [--repeat 3]
+"""
+import argparse
+import os
+import time
+
+from ..core.hashers import available_hashers, get_hasher, is_cryptographic
+
+
+def bench(name, data, repeat):
+    view = memoryview(data)
+    chunk = 1024 * 1024
+    best = None
+    for _ in range(repeat):
+        hash_obj = get_hasher(name)
+        start = time.perf_counter()
+        for offset in range(0, len(view), chunk):
+            hash_obj.update(view[offset:offset + chunk])
+        hash_obj.digest()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(data) / best / (1024 * 1024)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+
+    print(f'{"backend":>10} {"crypto":>7} {"MB/s":>10}')
+    for name in available_hashers():
+        print(f'{name:>10} {"yes" if is_cryptographic(name) else "no":>7} {bench(name, data, args.repeat):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""throughput of the streaming hash engine at different buffer sizes
+
+usage (from src/): python -m tools.benchmark.hash_buffer [--size-mb 256] [--repeat 3]
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from ..core.hashing import HashEngine
+
+BUFFER_SIZES = [4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+
+
+def make_file(path, size):
+    chunk = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            n = min(len(chunk), size - written)
+            f.write(chunk[:n])
+            written += n
+
+
+def bench(file_path, buffer_size, repeat):
+    size = os.path.getsize(file_path)
+    best = None
+    for _ in range(repeat):
+        engine = HashEngine(buffer_size)
+        start = time.perf_counter()
+        engine.hash_file(file_path, hashlib.md5())
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size / best / (1024 * 1024)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--file', help='hash an existing file instead of a generated one')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = args.file
+        if file_path is None:
+            file_path = os.path.join(tmp, 'bench.bin')
+            make_file(file_path, args.size_mb * 1024 * 1024)
+
+        print(f'{"buffer":>10} {"MB/s":>10}')
+        for buffer_size in BUFFER_SIZES:
+            print(f'{buffer_size // 1024:>8}KB {bench(file_path, buffer_size, args.repeat):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
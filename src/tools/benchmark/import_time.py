@@ -0,0 +1,57 @@
+"""cold import time of the headless entry points, fails when a budget is exceeded or a heavy module leaks in
+
+usage (from src/): python -m tools.benchmark.import_time [--budget-ms 300] [--repeat 5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+MODULES = ['tools.core.duplicate_file_removal_tool', 'tools.cli']
+HEAVY_MODULES = ['numpy', 'pandas', 'tqdm', 'send2trash', 'PySide6']
+
+
+def import_time(module, src_dir):
+    """cumulative microseconds for module, from -X importtime, plus the heavy modules it pulled in"""
+    code = f'import sys, {module}; print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=src_dir,
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    cumulative = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            cumulative = int(parts[1])
+    leaked = [m for m in result.stdout.strip().split(',') if m]
+    return cumulative, leaked
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=300)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    src_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    failed = False
+
+    print(f'{"module":<45} {"best ms":>10} {"budget":>8}  heavy imports')
+    for module in MODULES:
+        best = None
+        leaked = []
+        for _ in range(args.repeat):
+            cumulative, leaked = import_time(module, src_dir)
+            best = cumulative if best is None else min(best, cumulative)
+        best_ms = best / 1000
+        ok = best_ms <= args.budget_ms and not leaked
+        failed = failed or not ok
+        print(f'{module:<45} {best_ms:>10.1f} {args.budget_ms:>8.0f}  {", ".join(leaked) or "-"}{"" if ok else "  FAIL"}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""time every stage of the pipeline on a synthetic tree, with files/s, MB/s and peak RSS, as JSON
+
+the stages run in process on a warm page cache (the tree was just written), with no hash cache. the
+results of two commits are compared with --baseline, --max-regression turns a slowdown into exit code 1
+
+usage (from src/): python -m tools.benchmark.pipeline [--files 20000] [--size-median 65536] [--repeat 3]
+                   [--tree DIR] [-o results.json] [--baseline old.json] [--max-regression 0.1]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from loguru import logger
+
+from ..core.duplicate_file_removal_tool import DuplicateFileRemoval, collect_file_info
+from ..core.file_index import FileIndex
+from ..core.grouping import digest_keys, shared_buckets
+from ..core.hashing import calc_md5
+from ..core.parallel import DEFAULT_WORKERS, ParallelHasher
+from ..core.plan import DedupPlan
+from ..core.progress import ProgressReporter
+from ..core.walker import Walker
+from .tree import MB, add_tree_arguments, generate_tree, tree_spec
+
+RESULTS_VERSION = 1
+
+
+def reset_peak_rss():
+    # Linux >= 4.0 resets VmHWM when 5 is written to clear_refs, elsewhere the peak only grows
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """peak resident set size in bytes, since the last reset where the OS supports it"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def stage_result(stage, seconds, files, nbytes=None, rss=None):
+    return {
+        'stage': stage,
+        'seconds': seconds,
+        'files': files,
+        'bytes': nbytes,
+        'files_per_s': files / seconds if seconds > 0 else None,
+        'mb_per_s': nbytes / MB / seconds if nbytes and seconds > 0 else None,
+        'peak_rss': rss,
+    }
+
+
+class StageTimer():
+    def __init__(self):
+        self.results = []
+
+    def run(self, stage, func, files=None, nbytes=None):
+        """time func(), files / nbytes may be callables of its result"""
+        reset_peak_rss()
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        files = files(result) if callable(files) else files
+        nbytes = nbytes(result) if callable(nbytes) else nbytes
+        self.results.append(stage_result(stage, seconds, files, nbytes, peak_rss()))
+        return result
+
+    def on_progress(self, progress):
+        # the hash stages run inside one refine call, the progress reporter marks where each one ends
+        if progress.done:
+            self.results.append(
+                stage_result(progress.stage.replace(' ', '_'), progress.elapsed, progress.files, progress.bytes, peak_rss()))
+            reset_peak_rss()
+
+
+def run_pipeline(tree_root, workers):
+    """one pass over every stage, returns (stage results, removals the plan found, removals the engine found)"""
+    timer = StageTimer()
+    walker = Walker()
+    records = timer.run('walk', lambda: list(walker.walk(tree_root)), len)
+    timer.run('collect_file_info', lambda: collect_file_info([record.path for record in records]), len)
+    index = timer.run('file_index', lambda: FileIndex.from_records(records), len)
+    size_buckets = timer.run('size_buckets', index.size_buckets, lambda buckets: sum(map(len, buckets.values())))
+    candidates = [record for bucket in size_buckets.values() for record in bucket]
+
+    # every hash stage over the same-size candidates, timed by the progress reporter
+    buckets = {file_size: [record.path for record in bucket] for file_size, bucket in size_buckets.items()}
+    keys = {record.path: (record.dev, record.ino, record.size, record.mtime_ns) for record in candidates}
+    with ParallelHasher(workers=workers) as hasher:
+        hasher.progress = ProgressReporter(on_progress=timer.on_progress, interval=float('inf'))
+        reset_peak_rss()
+        digests = hasher.refine(buckets, keys)
+        hasher.progress.end()
+
+    hashed = [record for record in candidates if record.path in digests]
+
+    def group_digests():
+        if not hashed:
+            return []
+        keys = digest_keys([record.size for record in hashed], [digests[record.path] for record in hashed])
+        return shared_buckets(keys)[1]
+
+    groups = timer.run('group', group_digests, len(hashed))
+
+    def plan_groups():
+        plan = DedupPlan(hasher.algorithm)
+        for positions in groups:
+            group = [hashed[i] for i in positions]
+            plan.add(group, digests[group[0].path])
+        return plan
+
+    plan = timer.run('plan', plan_groups, len(hashed))
+
+    # the single-threaded full md5 the first versions hashed every candidate with
+    timer.run('calc_md5', lambda: [calc_md5(record.path) for record in candidates], len,
+              sum(record.size for record in candidates))
+
+    def end_to_end():
+        worker = DuplicateFileRemoval(tree_root, walker=walker, workers=workers, dry_run=True)
+        worker.run()
+        return worker
+
+    worker = timer.run('end_to_end', end_to_end, len(records), sum(record.size for record in records))
+    return timer.results, plan.remove_count, worker.removal_count
+
+
+def best_runs(runs):
+    # the fastest run of each stage, slower ones are noise from the rest of the machine
+    best = {}
+    for results in runs:
+        for result in results:
+            current = best.get(result['stage'])
+            if current is None or result['seconds'] < current['seconds']:
+                best[result['stage']] = result
+    return [best[result['stage']] for result in runs[0]]
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True,
+                                text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(results, baseline, max_regression=None):
+    """print the speed of every stage against a baseline, returns the stages slower than max_regression"""
+    old = {result['stage']: result for result in baseline['stages']}
+    regressions = []
+    sys.stderr.write(f'{"stage":<22} {"baseline s":>11} {"now s":>11} {"change":>8}\n')
+    for result in results['stages']:
+        previous = old.get(result['stage'])
+        if previous is None:
+            continue
+        change = result['seconds'] / previous['seconds'] - 1 if previous['seconds'] > 0 else 0.0
+        flag = ''
+        if max_regression is not None and change > max_regression:
+            regressions.append(result['stage'])
+            flag = ' slower'
+        sys.stderr.write(f'{result["stage"]:<22} {previous["seconds"]:>11.3f} {result["seconds"]:>11.3f} '
+                         f'{change:>+7.1%}{flag}\n')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_tree_arguments(parser)
+    parser.add_argument('--tree', help='keep the generated tree in this directory and reuse it on the next run')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', default='-', help='JSON results file, - for stdout')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--max-regression',
+                        type=float,
+                        help='exit with 1 when a stage is slower than the baseline by more than this fraction')
+    args = parser.parse_args(argv)
+
+    # the engine's own log lines would drown the table
+    logger.disable('tools')
+    # the engine imports these lazily, load them first so no stage is timed with an import
+    import pandas  # noqa: F401
+    import tqdm  # noqa: F401
+
+    spec = tree_spec(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = args.tree or tmp
+        tree_root = os.path.join(base_dir, 'tree')
+        manifest_path = os.path.join(base_dir, 'manifest.json')
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if any(manifest.get(name) != value for name, value in spec.items()):
+                raise SystemExit(f'{base_dir} holds a tree generated with other options')
+        if manifest is None:
+            start = time.perf_counter()
+            manifest = generate_tree(tree_root, **spec)
+            sys.stderr.write(f'generated {manifest["files"]} files, {manifest["bytes"] / MB:.1f} MB '
+                             f'in {time.perf_counter() - start:.1f} s\n')
+            with open(manifest_path, 'w') as f:
+                json.dump(manifest, f, indent=2)
+
+        runs = []
+        for _ in range(max(args.repeat, 1)):
+            stages, planned, removed = run_pipeline(tree_root, args.workers)
+            if planned != manifest['duplicates'] or removed != manifest['duplicates']:
+                raise SystemExit(f'wrong result: {manifest["duplicates"]} duplicates in the tree, '
+                                 f'the plan found {planned}, the engine {removed}')
+            runs.append(stages)
+
+    results = {
+        'version': RESULTS_VERSION,
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'repeat': len(runs),
+        'tree': manifest,
+        'stages': best_runs(runs),
+    }
+
+    sys.stderr.write(f'{"stage":<22} {"seconds":>9} {"files/s":>12} {"MB/s":>9} {"peak RSS MB":>12}\n')
+    for result in results['stages']:
+        mb_per_s = f'{result["mb_per_s"]:>9.1f}' if result['mb_per_s'] is not None else f'{"":>9}'
+        rss = f'{result["peak_rss"] / MB:>12.1f}' if result['peak_rss'] is not None else f'{"":>12}'
+        files_per_s = result['files_per_s'] or 0
+        sys.stderr.write(f'{result["stage"]:<22} {result["seconds"]:>9.3f} {files_per_s:>12.0f} {mb_per_s} {rss}\n')
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""reproducible synthetic trees for the benchmarks: file count, depth, size distribution, duplicates and
+same-size files that differ in their head, middle or tail block
+
+usage (from src/): python -m tools.benchmark.tree DIR [--files 20000] [--depth 3] [--fanout 8] [--seed 0] ...
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+
+MB = 1024 * 1024
+# where a same-size file differs from the file it shares its size with: the head, head_tail or full stage tells them apart
+DIFFER_AT = ('head', 'middle', 'tail')
+# a same-size file xors one byte with its number among the files sharing that size, so at most 255 of them
+MAX_VARIANTS = 255
+
+
+def draw_size(rng, median, sigma, min_size, max_size):
+    return min(max(int(rng.lognormvariate(math.log(median), sigma)), min_size), max_size)
+
+
+def leaf_dirs(depth, fanout):
+    dirs = ['']
+    for level in range(depth):
+        dirs = [os.path.join(parent, f'd{level}_{i:03d}') for parent in dirs for i in range(fanout)]
+    return dirs
+
+
+def plan_tree(files=20000,
+              depth=3,
+              fanout=8,
+              size_median=64 * 1024,
+              size_sigma=2.0,
+              min_size=1,
+              max_size=64 * MB,
+              duplicate_ratio=0.2,
+              same_size_ratio=0.1,
+              seed=0):
+    """the files to write as (relative path, size, content seed, flip), flip is None or (offset, xor)
+
+    duplicate_ratio of the files are copies of another file, same_size_ratio of the others share their size
+    with an earlier file but not its content. returns (entries, manifest)
+    """
+    rng = random.Random(seed)
+    duplicates = int(round(files * duplicate_ratio))
+    originals = files - duplicates
+    same_size = int(round(originals * same_size_ratio))
+
+    # originals with a size of their own (so only a copy can match them)
+    entries = []
+    used_sizes = set()
+    for i in range(originals - same_size):
+        file_size = draw_size(rng, size_median, size_sigma, min_size, max_size)
+        while file_size in used_sizes:
+            file_size += 1
+        used_sizes.add(file_size)
+        entries.append((file_size, rng.getrandbits(64), None))
+
+    # same size as one of those, one byte differs
+    variants = {}
+    unique_count = len(entries)
+    for i in range(same_size):
+        if not unique_count:
+            break
+        base = rng.randrange(unique_count)
+        file_size, content_seed, _ = entries[base]
+        count = variants.get(base, 0) + 1
+        if count > MAX_VARIANTS:
+            continue
+        variants[base] = count
+        differ_at = DIFFER_AT[i % len(DIFFER_AT)]
+        offset = {'head': 0, 'middle': file_size // 2, 'tail': file_size - 1}[differ_at]
+        entries.append((file_size, content_seed, (offset, count)))
+
+    # copies, any original can be copied more than once
+    for i in range(files - len(entries)):
+        entries.append(entries[rng.randrange(len(entries))])
+
+    # spread over the leaf directories in random order, so copies do not sit next to their source
+    rng.shuffle(entries)
+    dirs = leaf_dirs(depth, fanout)
+    planned = [(os.path.join(dirs[i % len(dirs)], f'f{i:08d}.bin'), file_size, content_seed, flip)
+               for i, (file_size, content_seed, flip) in enumerate(entries)]
+
+    # every entry is its own content, equal entries are the copies
+    counts = {}
+    for entry in entries:
+        counts[entry] = counts.get(entry, 0) + 1
+    groups = [(entry[0], count) for entry, count in counts.items() if count > 1]
+
+    manifest = {
+        'files': len(planned),
+        'bytes': sum(file_size for _, file_size, _, _ in planned),
+        'dirs': len(dirs),
+        'depth': depth,
+        'fanout': fanout,
+        'size_median': size_median,
+        'size_sigma': size_sigma,
+        'min_size': min_size,
+        'max_size': max_size,
+        'duplicate_ratio': duplicate_ratio,
+        'same_size_ratio': same_size_ratio,
+        'seed': seed,
+        # what a correct run finds
+        'duplicate_groups': len(groups),
+        'duplicates': sum(count - 1 for _, count in groups),
+        'duplicate_bytes': sum(file_size * (count - 1) for file_size, count in groups),
+        'same_size_different': sum(variants.values()),
+    }
+    return planned, manifest
+
+
+def file_content(file_size, content_seed, flip):
+    data = random.Random(content_seed).randbytes(file_size)
+    if flip is None:
+        return data
+    offset, xor = flip
+    data = bytearray(data)
+    data[offset] ^= xor
+    return data
+
+
+def generate_tree(root, **spec):
+    """write the tree planned from spec under root, returns the manifest"""
+    planned, manifest = plan_tree(**spec)
+    made = set()
+    for rel_path, file_size, content_seed, flip in planned:
+        file_path = os.path.join(root, rel_path)
+        dir_path = os.path.dirname(file_path)
+        if dir_path not in made:
+            os.makedirs(dir_path, exist_ok=True)
+            made.add(dir_path)
+        with open(file_path, 'wb') as f:
+            f.write(file_content(file_size, content_seed, flip))
+    return manifest
+
+
+def add_tree_arguments(parser):
+    parser.add_argument('--files', type=int, default=20000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=8, help='sub directories per directory')
+    parser.add_argument('--size-median', type=int, default=64 * 1024, help='median of the log-normal file sizes')
+    parser.add_argument('--size-sigma', type=float, default=2.0, help='sigma of the log-normal file sizes')
+    parser.add_argument('--min-size', type=int, default=1)
+    parser.add_argument('--max-size', type=int, default=64 * MB)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.2, help='fraction of files that are copies')
+    parser.add_argument('--same-size-ratio',
+                        type=float,
+                        default=0.1,
+                        help='fraction of the other files that share a size but not the content')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def tree_spec(args):
+    return {
+        'files': args.files,
+        'depth': args.depth,
+        'fanout': args.fanout,
+        'size_median': args.size_median,
+        'size_sigma': args.size_sigma,
+        'min_size': max(args.min_size, 1),
+        'max_size': args.max_size,
+        'duplicate_ratio': args.duplicate_ratio,
+        'same_size_ratio': args.same_size_ratio,
+        'seed': args.seed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root')
+    add_tree_arguments(parser)
+    args = parser.parse_args(argv)
+
+    manifest = generate_tree(args.root, **tree_spec(args))
+    json.dump(manifest, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
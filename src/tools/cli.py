@@ -0,0 +1,295 @@
+"""headless entry point, imports the core engine only (no Qt)
+
+exit status: 0 no duplicates, 1 duplicates found (removed unless --dry-run), 2 bad arguments, 3 scan failed
+"""
+import argparse
+import csv
+import json
+import sys
+
+from loguru import logger
+
+EXIT_OK = 0
+EXIT_DUPLICATES = 1
+EXIT_USAGE = 2
+EXIT_ERROR = 3
+
+
+class GroupReporter():
+    """write every duplicate group as soon as it is decided, one JSON line per group or one CSV row per file"""
+    def __init__(self, stream, fmt='jsonl', dry_run=False):
+        self.stream = stream
+        self.fmt = fmt
+        self.dry_run = dry_run
+        self.groups = 0
+        self.writer = None
+        if fmt == 'csv':
+            self.writer = csv.writer(stream)
+            self.writer.writerow(['digest', 'algorithm', 'file_size', 'action', 'file_path'])
+
+    def __call__(self, group):
+        # report-only groups (near-duplicate images without --remove-similar) do not count for the exit status
+        if not group.report_only:
+            self.groups += 1
+        dry_run = self.dry_run or group.report_only
+        keep = group.keep.path
+        remove = [record.path for record in group.remove]
+        digest = group.digest
+        algorithm = group.algorithm
+        file_size = group.file_size
+
+        if self.writer is not None:
+            self.writer.writerow([digest, algorithm, file_size, 'keep', keep])
+            removal_action = 'would_remove' if group.report_only else 'remove'
+            for file_path in remove:
+                self.writer.writerow([digest, algorithm, file_size, removal_action, file_path])
+        else:
+            self.stream.write(
+                json.dumps({
+                    'digest': digest,
+                    'algorithm': algorithm,
+                    'file_size': file_size,
+                    'keep': keep,
+                    'keep_rule': group.rule,
+                    'kind': group.kind,
+                    'remove': remove,
+                    'dry_run': dry_run,
+                }) + '\n')
+        self.stream.flush()
+
+
+def write_delta(delta, delta_path):
+    """one JSON line per new / changed / deleted file of an incremental scan"""
+    with open(delta_path, 'w', encoding='utf-8') as f:
+        for status, records in (('new', delta.new), ('changed', delta.changed), ('deleted', delta.deleted)):
+            for record in records:
+                f.write(json.dumps({'status': status, 'path': record.path, 'size': record.size}, ensure_ascii=False) + '\n')
+
+
+def make_metrics(args):
+    from .core.metrics import JsonLinesSink, LogSink, MetricsRecorder, PrometheusTextfileSink
+
+    sinks = []
+    if args.metrics:
+        sinks.append(LogSink())
+    if args.metrics_json:
+        sinks.append(JsonLinesSink(args.metrics_json))
+    if args.metrics_prom:
+        sinks.append(PrometheusTextfileSink(args.metrics_prom))
+    if not sinks and args.profile is None:
+        return None
+    return MetricsRecorder(sinks, args.profile, args.profile_dir)
+
+
+def scan(args):
+    from .core.duplicate_file_removal_tool import DuplicateFileRemoval
+    from .core.actions import DEFAULT_JOURNAL_PATH
+    from .core.hash_cache import DEFAULT_CACHE_PATH
+    from .core.snapshot import DEFAULT_SNAPSHOT_PATH
+    from .core.walker import Walker
+
+    walker = Walker(workers=args.scan_workers,
+                    include=args.include,
+                    exclude=args.exclude,
+                    min_size=args.min_size,
+                    max_size=args.max_size,
+                    follow_symlinks=args.follow_symlinks)
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    try:
+        reporter = GroupReporter(output, args.format, args.dry_run)
+        worker = DuplicateFileRemoval(args.path,
+                                      reference_roots=args.reference,
+                                      reference_index=args.reference_index,
+                                      similar=args.similar,
+                                      similar_distance=args.similar_distance,
+                                      remove_similar=args.remove_similar,
+                                      cache_path=None if args.no_cache else (args.cache or DEFAULT_CACHE_PATH),
+                                      walker=walker,
+                                      streaming=args.streaming,
+                                      workers=args.workers,
+                                      verify=args.verify,
+                                      dry_run=args.dry_run,
+                                      on_group=reporter,
+                                      table_path=args.table,
+                                      action=args.action,
+                                      journal_path=None if args.no_journal else (args.journal or DEFAULT_JOURNAL_PATH),
+                                      snapshot_path=(args.snapshot or DEFAULT_SNAPSHOT_PATH) if args.incremental else None,
+                                      watch=args.watch,
+                                      watch_interval=args.watch_interval,
+                                      metrics=make_metrics(args),
+                                      checkpoint_path=args.checkpoint,
+                                      checkpoint_interval=args.checkpoint_interval,
+                                      progress_bar=not args.quiet)
+        try:
+            worker.run()
+        except ValueError as ex:
+            logger.error(ex)
+            return EXIT_USAGE
+        except (FileNotFoundError, OSError) as ex:
+            logger.error(ex)
+            return EXIT_ERROR
+        if args.delta and worker.delta is not None:
+            write_delta(worker.delta, args.delta)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    return EXIT_DUPLICATES if reporter.groups else EXIT_OK
+
+
+def journal(args):
+    from .core.actions import DEFAULT_JOURNAL_PATH, Journal, replay, undo
+
+    journal_path = args.journal or DEFAULT_JOURNAL_PATH
+    if args.journal_command == 'show':
+        for entry in Journal.state(journal_path).values():
+            sys.stdout.write(f'{entry["status"]:<8} {entry["action"]:<9} {entry["path"]} -> {entry["keep"]}\n')
+        return EXIT_OK
+    if args.journal_command == 'replay':
+        done, failed = replay(journal_path)
+        logger.info(f'replayed {done} actions, {failed} failed')
+    else:
+        done, failed = undo(journal_path)
+        logger.info(f'undone {done} actions, {failed} failed')
+    return EXIT_ERROR if failed else EXIT_OK
+
+
+def index(args):
+    from .core.hash_cache import DEFAULT_CACHE_PATH, HashCache
+    from .core.parallel import ParallelHasher
+    from .core.reference import ReferenceIndex
+    from .core.walker import Walker
+
+    walker = Walker(workers=args.scan_workers, include=args.include, exclude=args.exclude, min_size=args.min_size)
+    cache = None if args.no_cache else HashCache(args.cache or DEFAULT_CACHE_PATH)
+    try:
+        with ParallelHasher(cache=cache, workers=args.workers) as hasher, ReferenceIndex(args.output) as reference_index:
+            reference_index.build(args.path, hasher, walker)
+    except ValueError as ex:
+        logger.error(ex)
+        return EXIT_USAGE
+    except OSError as ex:
+        logger.error(ex)
+        return EXIT_ERROR
+    finally:
+        if cache is not None:
+            cache.close()
+    return EXIT_OK
+
+
+def cache(args):
+    from .core.hash_cache import main as cache_main
+    cache_main(args.cache_args)
+    return EXIT_OK
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='dfr', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-q', '--quiet', action='store_true', help='only log warnings and errors')
+
+    p = subparsers.add_parser('scan', parents=[common], help='find (and remove) duplicate files under a directory')
+    p.add_argument('path', nargs='+', help='target roots, duplicates under them are acted on')
+    p.add_argument('-n', '--dry-run', action='store_true', help='report duplicate groups, change nothing')
+    p.add_argument('-f', '--format', choices=['jsonl', 'csv'], default='jsonl')
+    p.add_argument('-o', '--output', default='-', help='report file, - for stdout')
+    p.add_argument('--table', help='also write every duplicate file as a table (.csv, .parquet, .pkl, .xlsx), needs pandas')
+    p.add_argument('--streaming', action='store_true', help='report groups while the walk is still running')
+    p.add_argument('--verify', action='store_true', help='compare bytes before removing')
+    p.add_argument('--workers', type=int, default=None, help='hashing threads')
+    p.add_argument('--scan-workers', type=int, default=8, help='directory listing threads')
+    p.add_argument('--cache', help='hash cache database')
+    p.add_argument('--no-cache', action='store_true')
+    p.add_argument('--include', action='append', help='glob, may be repeated')
+    p.add_argument('--exclude', action='append', help='glob, may be repeated')
+    p.add_argument('--min-size', type=int, default=1)
+    p.add_argument('--max-size', type=int)
+    p.add_argument('--follow-symlinks', action='store_true')
+    p.add_argument('--action',
+                   choices=['trash', 'unlink', 'hardlink', 'symlink', 'reflink', 'link'],
+                   default='trash',
+                   help='what happens to each duplicate, the link actions keep every path '
+                   '(link: reflink where supported, hardlink otherwise)')
+    p.add_argument('--journal', help='action journal (JSON lines)')
+    p.add_argument('--no-journal', action='store_true')
+    p.add_argument('--incremental',
+                   action='store_true',
+                   help='list only directories whose mtime changed since the last incremental scan, '
+                   'match new / changed files against the stored index')
+    p.add_argument('--snapshot', help='tree snapshot database for --incremental')
+    p.add_argument('--delta', help='write the new / changed / deleted files of --incremental (JSON lines)')
+    p.add_argument('--watch',
+                   action='store_true',
+                   help='keep running and classify every new file as it is written (inotify, polling elsewhere), '
+                   'Ctrl-C stops')
+    p.add_argument('--watch-interval', type=float, default=2.0, help='seconds between polls without inotify')
+    p.add_argument('--reference',
+                   action='append',
+                   help='reference root, never modified: target files with the same content are duplicates, '
+                   'may be repeated')
+    p.add_argument('--reference-index', help='reference library hash index built with the index command')
+    p.add_argument('--similar',
+                   choices=['ahash', 'dhash', 'phash'],
+                   help='also report near-duplicate images (resized, re-encoded) by perceptual hash, needs Pillow')
+    p.add_argument('--similar-distance', type=int, default=6, help='max differing bits of two similar images (of 64)')
+    p.add_argument('--remove-similar', action='store_true', help='act on similar images too, the largest one is kept')
+    p.add_argument('--metrics', action='store_true', help='log wall / CPU time, syscalls, bytes read and cache hits per stage')
+    p.add_argument('--metrics-json', help='append the per-stage metrics of the run to this JSON lines file')
+    p.add_argument('--metrics-prom', help='write the per-stage metrics to this Prometheus textfile (node_exporter)')
+    p.add_argument('--profile',
+                   choices=['cprofile', 'sample'],
+                   help='profile every stage: cProfile (calling thread only, .prof) or stack sampling of all threads '
+                   '(collapsed stacks, .folded)')
+    p.add_argument('--profile-dir', default='.', help='where the --profile files go')
+    p.add_argument('--checkpoint',
+                   help='save the walk, digests and actions to this file; a stopped or crashed scan with the same roots '
+                   'continues from it, it is removed when the scan finishes')
+    p.add_argument('--checkpoint-interval', type=float, default=30.0, help='seconds between two checkpoint commits')
+    p.set_defaults(func=scan)
+
+    p = subparsers.add_parser('journal', parents=[common], help='show, replay or undo journaled actions')
+    p.add_argument('journal_command', choices=['show', 'replay', 'undo'])
+    p.add_argument('--journal', help='action journal (JSON lines)')
+    p.set_defaults(func=journal)
+
+    p = subparsers.add_parser('index', parents=[common], help='build or refresh the hash index of a reference library')
+    p.add_argument('path', nargs='+')
+    p.add_argument('-o', '--output', required=True, help='index database')
+    p.add_argument('--workers', type=int, default=None, help='hashing threads')
+    p.add_argument('--scan-workers', type=int, default=8, help='directory listing threads')
+    p.add_argument('--cache', help='hash cache database')
+    p.add_argument('--no-cache', action='store_true')
+    p.add_argument('--include', action='append', help='glob, may be repeated')
+    p.add_argument('--exclude', action='append', help='glob, may be repeated')
+    p.add_argument('--min-size', type=int, default=1)
+    p.set_defaults(func=index)
+
+    p = subparsers.add_parser('cache', help='maintain the hash cache, see: cache -h', add_help=False)
+    p.add_argument('cache_args', nargs=argparse.REMAINDER)
+    p.set_defaults(func=cache)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit as ex:
+        return EXIT_USAGE if ex.code else EXIT_OK
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING' if getattr(args, 'quiet', False) else 'INFO')
+
+    if args.command in ('scan', 'index') and args.workers is None:
+        from .core.parallel import DEFAULT_WORKERS
+        args.workers = DEFAULT_WORKERS
+
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
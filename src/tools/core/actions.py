@@ -0,0 +1,358 @@
+import errno
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DEFAULT_JOURNAL_PATH = os.path.join(os.path.expanduser('~'), '.duplicate_file_removal', 'journal.jsonl')
+
+# linux/fs.h
+FICLONE = 0x40049409
+
+ACTIONS = ['trash', 'unlink', 'hardlink', 'symlink', 'reflink', 'link']
+# actions that keep every path, the duplicate ends up sharing data with the kept file
+LINK_ACTIONS = ('hardlink', 'symlink', 'reflink', 'link')
+
+# errors that mean 'this filesystem cannot clone', not 'this file is broken'
+_REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.ENOSYS}
+
+
+def move_to_trash(file_path):
+    from send2trash import send2trash
+    # send2trash wants native separators (backslashes on Windows), normpath is a no-op elsewhere
+    send2trash(os.path.normpath(file_path))
+
+
+def _temp_path(file_path):
+    dir_name, base_name = os.path.split(file_path)
+    return os.path.join(dir_name, f'.{base_name}.{uuid.uuid4().hex[:8]}.dfr-tmp')
+
+
+def _replace_atomically(file_path, create):
+    # build the replacement next to the file, then rename over it: the path never disappears
+    temp_path = _temp_path(file_path)
+    try:
+        create(temp_path)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def reflink(src, dst):
+    """dst becomes a copy-on-write clone of src (btrfs, XFS, ...), raises OSError where that is unsupported"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported on this platform', dst)
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+
+
+def _reflink_keep_stat(keep_path, file_path, temp_path):
+    # the clone is a new inode, keep the duplicate's own mode and times on it
+    reflink(keep_path, temp_path)
+    shutil.copystat(file_path, temp_path)
+
+
+def apply_action(action, file_path, keep_path):
+    """run one action, returns the method that was actually used ('link' resolves to reflink or hardlink)"""
+    if action == 'trash':
+        move_to_trash(file_path)
+    elif action == 'unlink':
+        os.unlink(file_path)
+    elif action == 'hardlink':
+        _replace_atomically(file_path, lambda temp_path: os.link(keep_path, temp_path))
+    elif action == 'symlink':
+        _replace_atomically(file_path, lambda temp_path: os.symlink(os.path.abspath(keep_path), temp_path))
+    elif action == 'reflink':
+        _replace_atomically(file_path, lambda temp_path: _reflink_keep_stat(keep_path, file_path, temp_path))
+    elif action == 'link':
+        # share extents where the filesystem can, otherwise share the inode (same device only)
+        try:
+            return apply_action('reflink', file_path, keep_path)
+        except OSError as ex:
+            if ex.errno not in _REFLINK_UNSUPPORTED:
+                raise
+        return apply_action('hardlink', file_path, keep_path)
+    else:
+        raise ValueError(f'unknown action: {action}, available: {", ".join(ACTIONS)}')
+    return action
+
+
+def check_unchanged(file_path, size, mtime_ns, dev=0, ino=0, follow_symlinks=False):
+    """stat of file_path, raises OSError when it is no longer the file that was planned
+
+    dev / ino 0 means the identity is unknown (reference index entries), only size and mtime are compared
+    """
+    st = os.stat(file_path, follow_symlinks=follow_symlinks)
+    if st.st_size != size or st.st_mtime_ns != mtime_ns or (ino and (st.st_dev, st.st_ino) != (dev, ino)):
+        raise OSError(errno.ESTALE, 'changed since scan', file_path)
+    return st
+
+
+def check_entry(entry):
+    """the checks of ActionExecutor for a journal entry, before it is replayed"""
+    check_unchanged(entry['path'], entry['size'], entry['mtime_ns'])
+    if 'keep_size' in entry:
+        check_unchanged(entry['keep'], entry['keep_size'], entry['keep_mtime_ns'], entry['keep_dev'], entry['keep_ino'],
+                        follow_symlinks=True)
+        return
+    # journals written before the keeper was recorded: it must still be there with the duplicate's size
+    keep_st = os.stat(entry['keep'])
+    if keep_st.st_size != entry['size']:
+        raise OSError(errno.ESTALE, 'changed since scan', entry['keep'])
+
+
+def restore_copy(entry):
+    """undo any action: the removed file had the keeper's content, put an independent copy back"""
+    file_path = entry['path']
+    keep_path = entry['keep']
+    keep_st = os.stat(keep_path)
+    if keep_st.st_size != entry['size']:
+        raise OSError(errno.ESTALE, f'keeper changed since the action, cannot restore from it: {keep_path}', file_path)
+
+    def create(temp_path):
+        shutil.copyfile(keep_path, temp_path)
+        os.chmod(temp_path, entry['mode'])
+        os.utime(temp_path, ns=(entry['atime_ns'], entry['mtime_ns']))
+
+    if os.path.lexists(file_path):
+        _replace_atomically(file_path, create)
+    else:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        create(file_path)
+
+
+class Journal():
+    """append-only JSON lines journal, a 'planned' entry is written before each action and a 'done' /
+    'failed' entry after it, so a crash leaves planned entries that can be replayed"""
+    def __init__(self, journal_path=DEFAULT_JOURNAL_PATH):
+        self.journal_path = journal_path
+        os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+        self.f = open(journal_path, 'a', encoding='utf-8')
+
+    def write(self, entries, sync=False):
+        if not entries:
+            return
+        self.f.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+        self.f.flush()
+        if sync:
+            os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+    @staticmethod
+    def read(journal_path):
+        with open(journal_path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    @staticmethod
+    def state(journal_path):
+        """{id: last entry} in journal order"""
+        state = {}
+        for entry in Journal.read(journal_path):
+            state.pop(entry['id'], None)
+            state[entry['id']] = entry
+        return state
+
+
+def _entry(entry, status, **extra):
+    return dict(entry, status=status, time=time.time(), **extra)
+
+
+def replay(journal_path):
+    """run the actions that were planned but never finished (crash, kill), returns (done, failed)"""
+    journal = Journal(journal_path)
+    done = failed = 0
+    try:
+        for entry in Journal.state(journal_path).values():
+            if entry['status'] != 'planned':
+                continue
+            try:
+                # whatever is at the path now may not be the file the entry was planned for
+                check_entry(entry)
+                method = apply_action(entry['action'], entry['path'], entry['keep'])
+            except Exception as ex:
+                logger.info(ex)
+                journal.write([_entry(entry, 'failed', error=str(ex))])
+                failed += 1
+            else:
+                journal.write([_entry(entry, 'done', method=method)])
+                done += 1
+    finally:
+        journal.close()
+    return done, failed
+
+
+def undo(journal_path):
+    """restore every file whose last journal entry is 'done', newest first, returns (undone, failed)"""
+    journal = Journal(journal_path)
+    undone = failed = 0
+    try:
+        for entry in reversed(list(Journal.state(journal_path).values())):
+            if entry['status'] != 'done':
+                continue
+            try:
+                restore_copy(entry)
+            except Exception as ex:
+                logger.info(ex)
+                failed += 1
+            else:
+                journal.write([_entry(entry, 'undone')])
+                undone += 1
+    finally:
+        journal.close()
+    return undone, failed
+
+
+class ActionExecutor():
+    """drains planned removals on a background thread, in batches, and journals every action
+
+    a file whose size or mtime changed since the scan is skipped instead of being acted on, so is one whose
+    keeper changed and a duplicate that already is a hardlink of its keeper. bytes_reclaimed counts the data
+    of files whose last link was unlinked or replaced by a link, bytes_trashed that of files moved to the
+    trash, which frees nothing until the trash is emptied.
+    """
+    def __init__(self, action='trash', journal_path=DEFAULT_JOURNAL_PATH, batch_size=256, linger=0.2):
+        if action not in ACTIONS:
+            raise ValueError(f'unknown action: {action}, available: {", ".join(ACTIONS)}')
+        self.action = action
+        self.journal = None if journal_path is None else Journal(journal_path)
+        self.batch_size = batch_size
+        self.linger = linger
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes_reclaimed = 0
+        self.bytes_trashed = 0
+        # called with the finished entries of every batch once they are journaled (a checkpoint)
+        self.on_finished = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._drain, name='action-executor', daemon=True)
+        self.thread.start()
+
+    def submit(self, record, keep):
+        self.queue.put((record, keep))
+
+    def _next_batch(self):
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _drain(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        planned = []
+        for record, keep in batch:
+            try:
+                st = os.lstat(record.path)
+            except OSError as ex:
+                logger.info(ex)
+                self.failed += 1
+                continue
+            if st.st_size != record.size or st.st_mtime_ns != record.mtime_ns:
+                logger.info(f'changed since scan, skipped: {record.path}')
+                self.failed += 1
+                continue
+            # the keeper is what the duplicate's content survives in (or is linked to), it must be unchanged too
+            try:
+                keep_st = check_unchanged(keep.path, keep.size, keep.mtime_ns, keep.dev, keep.ino, follow_symlinks=True)
+            except OSError as ex:
+                logger.info(f'keeper changed since scan, skipped: {record.path} ({ex})')
+                self.failed += 1
+                continue
+            if self.action in LINK_ACTIONS and (st.st_dev, st.st_ino) == (keep_st.st_dev, keep_st.st_ino):
+                self.skipped += 1
+                continue
+            planned.append({
+                'id': uuid.uuid4().hex,
+                'action': self.action,
+                'path': record.path,
+                'keep': keep.path,
+                'size': st.st_size,
+                'mode': st.st_mode & 0o7777,
+                'atime_ns': st.st_atime_ns,
+                'mtime_ns': st.st_mtime_ns,
+                'nlink': st.st_nlink,
+                'keep_size': keep_st.st_size,
+                'keep_mtime_ns': keep_st.st_mtime_ns,
+                'keep_dev': keep_st.st_dev,
+                'keep_ino': keep_st.st_ino,
+                'status': 'planned',
+                'time': time.time(),
+            })
+
+        # write-ahead: the planned entries are on disk before any file is touched
+        if self.journal is not None:
+            self.journal.write(planned, sync=True)
+
+        finished = []
+        for entry in planned:
+            try:
+                method = apply_action(self.action, entry['path'], entry['keep'])
+            except Exception as ex:
+                logger.info(ex)
+                self.failed += 1
+                finished.append(_entry(entry, 'failed', error=str(ex)))
+            else:
+                self.done += 1
+                if entry['nlink'] == 1 and self.action == 'trash':
+                    self.bytes_trashed += entry['size']
+                elif entry['nlink'] == 1:
+                    self.bytes_reclaimed += entry['size']
+                finished.append(_entry(entry, 'done', method=method))
+
+        if self.journal is not None:
+            self.journal.write(finished, sync=True)
+        if self.on_finished is not None and finished:
+            self.on_finished(finished)
+
+    def close(self, cancel=False):
+        # cancel drops the removals still queued, a batch already journaled as planned is finished
+        if cancel:
+            try:
+                while True:
+                    self.queue.get_nowait()
+            except queue.Empty:
+                pass
+        self.queue.put(None)
+        self.thread.join()
+        if self.journal is not None:
+            self.journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,153 @@
+import marshal
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from .walker import FileRecord
+
+DEFAULT_CHECKPOINT_PATH = os.path.join(os.path.expanduser('~'), '.duplicate_file_removal', 'checkpoint.db')
+# seconds between two commits, a crash loses at most this much of the walk
+DEFAULT_CHECKPOINT_INTERVAL = 30.0
+
+# walk: listing directories, hash: the file list is complete, act: the plan is being carried out
+PHASES = ('walk', 'hash', 'act')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS frontier (
+    path TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS listings (
+    dir_path TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    records BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS acted (
+    path TEXT PRIMARY KEY
+) WITHOUT ROWID;
+'''
+
+
+class Checkpoint():
+    """resumable state of one batch scan, SQLite in WAL mode
+
+    holds the directories still to list (the walk frontier), the records of every directory already listed
+    (one marshalled row per directory, a row per file would cost more than the walk itself), the phase and
+    the paths already acted on. the digests are not stored here: the engine hashes through a HashCache (in
+    the same file when no other cache is given), it is flushed with every commit. writes are buffered in
+    memory and committed every interval seconds, frontier and records in one transaction so a listed
+    directory is either in the frontier or has its records stored. acted paths are committed per executor
+    batch.
+
+    a checkpoint written for other roots or walker filters (the signature) is started over.
+    """
+    def __init__(self, db_path, signature, interval=DEFAULT_CHECKPOINT_INTERVAL, cache=None):
+        self.db_path = db_path
+        self.interval = interval
+        self.cache = cache
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # the actions executor reports from its own thread
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+        meta = dict(self.conn.execute('SELECT name, value FROM meta'))
+        self.resumed = meta.get('signature') == signature and meta.get('phase') in PHASES
+        if not self.resumed:
+            with self.conn:
+                for table in ('meta', 'frontier', 'listings', 'acted'):
+                    self.conn.execute(f'DELETE FROM {table}')
+                self.conn.executemany('INSERT INTO meta VALUES (?, ?)', [('signature', signature), ('phase', 'walk')])
+            meta = {'phase': 'walk'}
+        self.phase = meta['phase']
+        self.frontier = set(row[0] for row in self.conn.execute('SELECT path FROM frontier'))
+        self.frontier_changed = False
+        self._listings = []
+        self._acted = []
+        self.committed_at = time.monotonic()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COALESCE(SUM(count), 0) FROM listings').fetchone()[0]
+
+    def start_walk(self, roots):
+        """the directories to list: the roots on a new scan, the stored frontier when resuming one"""
+        if self.phase != 'walk':
+            return []
+        if not self.resumed:
+            self.frontier = set(os.fspath(root) for root in roots)
+            self.frontier_changed = True
+        return sorted(self.frontier)
+
+    def records(self):
+        """the records of the directories listed by an earlier run, without the files it already acted on"""
+        if not self.resumed:
+            return
+        acted = self.acted_paths()
+        for (data, ) in self.conn.execute('SELECT records FROM listings ORDER BY rowid'):
+            yield from (FileRecord._make(row) for row in marshal.loads(data) if row[0] not in acted)
+
+    def listed(self, dir_path, records, sub_dirs):
+        self.frontier.discard(dir_path)
+        self.frontier.update(sub_dirs)
+        self.frontier_changed = True
+        if records:
+            self._listings.append((dir_path, len(records), marshal.dumps([tuple(record) for record in records])))
+        if time.monotonic() - self.committed_at >= self.interval:
+            self.commit()
+
+    def set_phase(self, phase):
+        self.phase = phase
+        self.commit()
+
+    def acted_paths(self):
+        with self._lock:
+            return set(row[0] for row in self.conn.execute('SELECT path FROM acted')) | set(self._acted)
+
+    def record_actions(self, entries):
+        # ActionExecutor.on_finished, runs on the executor thread
+        with self._lock:
+            self._acted.extend(entry['path'] for entry in entries if entry['status'] == 'done')
+        self.commit()
+
+    def commit(self):
+        if self.cache is not None:
+            self.cache.flush()
+        with self._lock, self.conn:
+            if self._listings:
+                self.conn.executemany('INSERT INTO listings VALUES (?, ?, ?)', self._listings)
+                self._listings = []
+            if self.frontier_changed:
+                self.conn.execute('DELETE FROM frontier')
+                self.conn.executemany('INSERT INTO frontier VALUES (?)', ((path, ) for path in self.frontier))
+                self.frontier_changed = False
+            if self._acted:
+                self.conn.executemany('INSERT OR IGNORE INTO acted VALUES (?)', ((path, ) for path in self._acted))
+                self._acted = []
+            self.conn.execute("UPDATE meta SET value=? WHERE name='phase'", (self.phase, ))
+        self.committed_at = time.monotonic()
+
+    def close(self, finished=False):
+        """a finished scan needs no checkpoint, its file is removed; otherwise the last state is committed
+
+        the cache was closed (and flushed) by its owner before
+        """
+        self.cache = None
+        if not finished:
+            self.commit()
+            self.conn.close()
+            logger.info(f'Checkpoint: {self.db_path} ({self.phase}), run again to resume')
+            return
+        self.conn.close()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.db_path + suffix)
+            except FileNotFoundError:
+                pass
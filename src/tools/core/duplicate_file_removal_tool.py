@@ -1,157 +1,749 @@
-import hashlib
-import multiprocessing
+import json
 import os
-from glob import glob
+import sys
+from collections import namedtuple
+from stat import S_ISDIR
 from threading import Thread
 
-import numpy as np
-import pandas as pd
 from loguru import logger
-from multiprocess import Pool
-from send2trash import send2trash
-from tqdm import tqdm
 
-
-def calc_md5(file_path):
-    with open(file_path, 'rb') as f:
-        md5obj = hashlib.md5()
-        md5obj.update(f.read())
-        hash = md5obj.hexdigest()
-        return hash
+# numpy / pandas / tqdm / send2trash are imported where they are used, a small scan never pays for them
+from . import actions
+from .actions import DEFAULT_JOURNAL_PATH, ActionExecutor
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL, Checkpoint
+from .hash_cache import HashCache
+# re-exported, calc_md5 was defined in this module before hashing.py
+from .hashing import calc_md5  # noqa: F401
+from .export import export_table
+from .io_scheduler import IOScheduler
+from .metrics import measure
+from .parallel import DEFAULT_WORKERS, ParallelHasher
+from .plan import DedupPlan
+from .progress import CancelToken, Cancelled, track
+from .reference import ReferenceIndex
+from .snapshot import TreeSnapshot, merge_deltas
+from .stages import DEFAULT_STAGES, StagedHasher
+from .streaming import StreamingDeduplicator
+from .walker import FileRecord, Walker
+from .watch import DEFAULT_DEBOUNCE, Debouncer, make_watcher
 
 
 def move_to_trash(file_path):
     try:
-        send2trash(file_path.replace('/', '\\'))
+        actions.move_to_trash(file_path)
     except Exception as ex:
         logger.info(ex)
 
 
-def remove_duplicate_files_by_md5(file_list):
+def file_cache_keys(file_list_df):
+    file_paths = file_list_df['file_path'].tolist()
+    return dict(
+        zip(file_paths,
+            zip(file_list_df['dev'].tolist(), file_list_df['ino'].tolist(), file_list_df['file_size'].tolist(),
+                file_list_df['mtime_ns'].tolist())))
 
-    file_list_df = file_list[1]
 
-    file_list_df['md5'] = file_list_df['file_path'].apply(lambda x: calc_md5(x))
-    duplicate_md5_df = file_list_df.groupby('md5').filter(lambda group: len(group) > 1)
-    duplicate_md5_count = len(duplicate_md5_df)
-    if (duplicate_md5_count == 0):
-        # logger.info('no duplicate file (by file md5) exists')
-        return 0
+def remove_duplicate_records(records, digest, algorithm, verify=False, dry_run=False, on_group=None, executor=None):
+    """keep the first file by create_date and modify_date, remove the others, return how many were removed
 
-    duplicate_md5_group = duplicate_md5_df.groupby('md5')
+    with an executor the removals are only queued, it trashes / unlinks / links them in the background
+    """
+    plan = DedupPlan(algorithm)
+    plan.add(records, digest, verify=verify)
+    return plan.execute(dry_run, executor, on_group)
 
-    for name, group in duplicate_md5_group:
 
-        group.sort_values(by=['create_date', 'modify_date'], ascending=True, inplace=True)
-        group['duplicate'] = group.duplicated(["md5"], keep="first")
-        removal_files_df = group[group['duplicate'] == True]
-        removal_files_df['file_path'].apply(lambda file: move_to_trash(file))
+def records_from_dataframe(file_list_df):
+    # FileRecords of DataFrame rows, frames without the identity columns get zeros
+    count = len(file_list_df)
 
-        return len(removal_files_df)
+    def column(name):
+        return file_list_df[name].tolist() if name in file_list_df.columns else [0] * count
 
-        # logger.info(f'remove {len(removal_files_df)} duplicate files by file md5')
+    return list(
+        map(FileRecord._make,
+            zip(file_list_df['file_path'].tolist(), file_list_df['file_size'].tolist(), column('ino'), column('dev'),
+                file_list_df['modify_date'].tolist(), file_list_df['create_date'].tolist(), column('mtime_ns'))))
 
 
-def collect_file_info(file_list):
-    df = pd.DataFrame(columns=['file_path', 'file_size', 'create_date', 'modify_date'])
+def plan_duplicate_files_by_md5(file_list, hasher=None, digests=None, verify=False):
+    """DedupPlan for one (file_size, DataFrame) bucket, every hash group of the bucket is resolved"""
 
-    for file_path in file_list:
+    file_size, file_list_df = file_list
 
-        file_size = os.path.getsize(file_path)
+    # files dropped by an earlier (head / tail) stage keep a NaN digest and never form a group
+    if hasher is None:
+        hasher = StagedHasher()
+    if digests is None:
+        keys = file_cache_keys(file_list_df) if 'mtime_ns' in file_list_df.columns else None
+        digests = hasher.find_duplicates(file_list_df['file_path'].tolist(), file_size, keys)
+    file_list_df['digest'] = file_list_df['file_path'].map(digests)
+    file_list_df['algorithm'] = hasher.algorithm
+    # vectorized mask instead of a Python call per digest group, NaN digests would count as equal
+    duplicate_md5_df = file_list_df[file_list_df['digest'].notna() & file_list_df.duplicated('digest', keep=False)]
+
+    plan = DedupPlan(hasher.algorithm)
+    groups = {}
+    for record, digest in zip(records_from_dataframe(duplicate_md5_df), duplicate_md5_df['digest'].tolist()):
+        groups.setdefault(digest, []).append(record)
+    for digest, records in groups.items():
+        plan.add(records, digest, verify=verify)
+    return plan
 
-        if os.path.isdir(file_path) or file_size == 0:
-            continue
 
-        create_date = os.path.getctime(file_path)
-        modify_date = os.path.getmtime(file_path)
+def remove_duplicate_files_by_md5(file_list, hasher=None, digests=None, verify=False, dry_run=False, on_group=None):
+    """resolve every hash group of the bucket, then act on the plan once; returns how many files were removed
 
-        df = df.append({
-            'file_path': file_path,
-            'file_size': file_size,
-            'create_date': create_date,
-            'modify_date': modify_date
-        },
-                       ignore_index=True)
+    on_group(group_df, removal_df) gets each group's rows, keeper first
+    """
+    plan = plan_duplicate_files_by_md5(file_list, hasher, digests, verify)
+    if not plan.groups:
+        return 0
 
-    return df
+    rows = file_list[1].set_index('file_path', drop=False) if on_group is not None else None
 
+    def _report(group):
+        group_df = rows.loc[[group.keep.path] + [record.path for record in group.remove]]
+        on_group(group_df, group_df.iloc[1:])
+
+    return plan.execute(dry_run, on_group=_report if on_group is not None else None)
 
-class ScanFiles():
-    def __init__(self, path):
-        self.file_list = []
-        self.scan(path)
 
-    def scan(self, dir):
+FILE_INFO_COLUMNS = ['file_path', 'file_size', 'create_date', 'modify_date', 'dev', 'ino', 'mtime_ns']
+
+
+def collect_file_info(file_list):
+    # one stat per file into preallocated columns, the DataFrame is built once at the end
+    import numpy as np
+    import pandas as pd
+
+    count = len(file_list)
+    file_paths = np.empty(count, dtype=object)
+    file_sizes = np.empty(count, dtype=np.int64)
+    create_dates = np.empty(count, dtype=np.float64)
+    modify_dates = np.empty(count, dtype=np.float64)
+    devs = np.empty(count, dtype=np.uint64)
+    inos = np.empty(count, dtype=np.uint64)
+    mtimes_ns = np.empty(count, dtype=np.int64)
+
+    n = 0
+    for file_path in file_list:
         try:
-            for i in os.scandir(dir):
-                if i.is_dir() and i.name[0] != '.' and i.name[0] != '$':
-                    self.scan(i)
-                else:
-                    self.file_list.append(i.path)
-        except Exception as ex:
+            st = os.stat(file_path)
+        except OSError as ex:
             logger.info(ex)
+            continue
+
+        if S_ISDIR(st.st_mode) or st.st_size == 0:
+            continue
+
+        file_paths[n] = file_path
+        file_sizes[n] = st.st_size
+        create_dates[n] = st.st_ctime
+        modify_dates[n] = st.st_mtime
+        devs[n] = st.st_dev
+        inos[n] = st.st_ino
+        mtimes_ns[n] = st.st_mtime_ns
+        n += 1
+
+    return pd.DataFrame({
+        'file_path': file_paths[:n],
+        'file_size': file_sizes[:n],
+        'create_date': create_dates[:n],
+        'modify_date': modify_dates[:n],
+        'dev': devs[:n],
+        'ino': inos[:n],
+        'mtime_ns': mtimes_ns[:n],
+    })
+
+
+def file_info_from_records(records):
+    # walker records already carry the stat result, no second stat per file
+    import numpy as np
+    import pandas as pd
+
+    count = len(records)
+    return pd.DataFrame({
+        'file_path': np.fromiter((r.path for r in records), dtype=object, count=count),
+        'file_size': np.fromiter((r.size for r in records), dtype=np.int64, count=count),
+        'create_date': np.fromiter((r.ctime for r in records), dtype=np.float64, count=count),
+        'modify_date': np.fromiter((r.mtime for r in records), dtype=np.float64, count=count),
+        'dev': np.fromiter((r.dev for r in records), dtype=np.uint64, count=count),
+        'ino': np.fromiter((r.ino for r in records), dtype=np.uint64, count=count),
+        'mtime_ns': np.fromiter((r.mtime_ns for r in records), dtype=np.int64, count=count),
+    })
+
+
+class ScanFiles():
+    def __init__(self, path, walker=None):
+        self.walker = Walker() if walker is None else walker
+        self.records = list(self.walker.walk(path))
+        self.file_list = [record.path for record in self.records]
+
+
+class References(namedtuple('References', ['live', 'indexed', 'head_stage'])):
+    # live: {size: [FileRecord]} walked, indexed: {size: [(FileRecord, head, digest)]} from a ReferenceIndex
+    __slots__ = ()
+
+    @property
+    def sizes(self):
+        return set(self.live) | set(self.indexed)
 
 
 class DuplicateFileRemoval(Thread):
-    def __init__(self, path):
+    def __init__(self,
+                 path,
+                 stages=DEFAULT_STAGES,
+                 cache_path=None,
+                 walker=None,
+                 streaming=False,
+                 workers=DEFAULT_WORKERS,
+                 use_processes=False,
+                 scheduler=None,
+                 verify=False,
+                 dry_run=False,
+                 on_group=None,
+                 table_path=None,
+                 action='trash',
+                 journal_path=DEFAULT_JOURNAL_PATH,
+                 snapshot_path=None,
+                 watch=False,
+                 watch_interval=2.0,
+                 debounce=DEFAULT_DEBOUNCE,
+                 reference_roots=None,
+                 reference_index=None,
+                 similar=None,
+                 similar_distance=6,
+                 remove_similar=False,
+                 progress=None,
+                 cancel_token=None,
+                 metrics=None,
+                 checkpoint_path=None,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+                 progress_bar=True):
         super(DuplicateFileRemoval, self).__init__()
+        # path: one target root or a list of them, everything under them may be acted on
         self.path = path
+        self.roots = [path] if isinstance(path, (str, os.PathLike)) else list(path)
+        # reference roots and a ReferenceIndex file are only matched against, never modified
+        self.reference_roots = list(reference_roots or [])
+        self.reference_index = reference_index
+        # near-duplicate images: perceptual hash kind, max Hamming distance; only reported unless remove_similar
+        self.similar = similar
+        self.similar_distance = similar_distance
+        self.remove_similar = remove_similar
+        self.similar_plan = None
+        self.stages = stages
+        self.cache_path = cache_path
+        self.walker = Walker() if walker is None else walker
+        self.streaming = streaming
+        self.workers = workers
+        self.use_processes = use_processes
+        # NFS / SMB cannot tell whether they spin, they get as many reads as there are workers
+        self.scheduler = IOScheduler(unknown_limit=workers) if scheduler is None else scheduler
+        self.verify = verify
+        self.dry_run = dry_run
+        self.on_group = on_group
+        self.table_path = table_path
+        self.action = action
+        self.journal_path = journal_path
+        self.snapshot_path = snapshot_path
+        self.delta = None
+        self.watch = watch
+        self.watch_interval = watch_interval
+        self.debounce = debounce
+        # ProgressReporter for a GUI (per-stage rates, batched groups), stop() cancels the token
+        self.progress = progress
+        self.cancel_token = CancelToken() if cancel_token is None else cancel_token
+        # MetricsRecorder: per-stage time and counters, emitted to its sinks when the run ends
+        self.metrics = metrics
+        # tqdm bar of the plan stage on stderr, never without a terminal or next to a ProgressReporter
+        self.progress_bar = progress_bar
+        # batch scans only: a run that is stopped or crashes continues from the checkpoint file next time
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint = None
+        self.executor = None
+        self.plan = None
+        self.groups = []
+        self.removal_count = None
+
+    def stop(self):
+        # checked between files and groups: hashing stops, queued removals are dropped, running ones finish
+        self.cancel_token.cancel()
+
+    def handle_group(self, group):
+        if self.table_path is not None:
+            self.groups.append(group)
+        if self.on_group is not None:
+            self.on_group(group)
+        if self.progress is not None:
+            self.progress.add_group(group)
+
+    def walk(self, walker, *roots):
+        return track(walker.walk(*roots), self.progress, self.cancel_token)
+
+    def checkpoint_signature(self):
+        # what the listed records depend on, the digests are cached per inode and stage anyway
+        walker = self.walker
+        return json.dumps({
+            'roots': [os.path.abspath(root) for root in self.roots],
+            'walker': [walker.include, walker.exclude, walker.min_size, walker.max_size, walker.follow_symlinks,
+                       walker.skip_hidden],
+        })
+
+    def checkpointed_walk(self, checkpoint):
+        # the records listed before, then only the directories still in the frontier
+        yield from checkpoint.records()
+        for dir_path, records, sub_dirs in self.walker.listings(*checkpoint.start_walk(self.roots)):
+            checkpoint.listed(dir_path, records, sub_dirs)
+            yield from records
+        if checkpoint.phase == 'walk':
+            checkpoint.set_phase('hash')
 
     def run(self):
+        error = None
+        try:
+            self.run_worker()
+        except Exception as ex:
+            error = ex
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.set('failed', int(error is not None))
+                self.metrics.emit()
+            if self.progress is not None:
+                self.progress.finish(error)
 
-        logger.info(f'worker start: {self.path}')
-
-        # collect file list
-        df = pd.DataFrame(columns=['file_path', 'file_size', 'create_date', 'modify_date'])
+    def run_worker(self):
 
-        file_list = ScanFiles(self.path).file_list
-        if (len(file_list) == 0):
-            raise FileNotFoundError(f'Cannot find files in: {self.path}')
+        logger.info(f'worker start: {self.path}')
 
-        # parse file list
-        if len(file_list) <= 32:
-            files_df = collect_file_info(file_list)
-        else:
-            NUM_USABLE_CPU = max(multiprocessing.cpu_count() - 2, 1)
-            workers = min(NUM_USABLE_CPU, len(file_list))
+        if (self.reference_roots or self.reference_index) and (self.watch or self.streaming):
+            raise ValueError('reference roots work with batch and incremental scans only')
+        if self.similar and (self.watch or self.streaming or self.snapshot_path is not None):
+            raise ValueError('similar images are only searched by batch scans')
+        if self.remove_similar and self.action in actions.LINK_ACTIONS:
+            raise ValueError(f'similar images differ in content, they cannot be replaced by {self.action}s')
+        if self.checkpoint_path is not None and (self.watch or self.streaming or self.snapshot_path is not None):
+            raise ValueError('checkpoints work with batch scans only')
+
+        # without a cache of their own the digests are kept next to the checkpoint, a resumed run reads them back
+        cache_path = self.checkpoint_path if self.cache_path is None else self.cache_path
+        cache = None if cache_path is None else HashCache(cache_path)
+        checkpoint = None
+        if self.checkpoint_path is not None:
+            checkpoint = self.checkpoint = Checkpoint(self.checkpoint_path, self.checkpoint_signature(),
+                                                      self.checkpoint_interval, cache)
+            if checkpoint.resumed:
+                logger.info(f'Checkpoint: resuming {self.checkpoint_path} ({checkpoint.phase}, {len(checkpoint)} files '
+                            f'listed, {len(checkpoint.frontier)} dirs left)')
+        hasher = ParallelHasher(self.stages,
+                                cache=cache,
+                                workers=self.workers,
+                                use_processes=self.use_processes,
+                                scheduler=self.scheduler)
+        hasher.progress = self.progress
+        hasher.cancel_token = self.cancel_token
+        hasher.metrics = self.metrics
+        if self.metrics is not None:
+            self.metrics.add_counter('bytes_read', lambda: hasher.bytes_read)
+            self.metrics.add_counter('stat_calls', lambda: self.walker.stat_calls)
+            self.metrics.add_counter('dirs_listed', lambda: self.walker.dirs_listed)
+            if cache is not None:
+                self.metrics.add_counter('cache_hits', lambda: cache.hits)
+                self.metrics.add_counter('cache_misses', lambda: cache.misses)
+
+        if not self.dry_run:
+            self.executor = ActionExecutor(self.action, self.journal_path)
+            if checkpoint is not None:
+                self.executor.on_finished = checkpoint.record_actions
+
+        snapshot = None
+        if self.snapshot_path is not None and not self.watch:
+            snapshot = TreeSnapshot(self.snapshot_path)
+
+        finished = False
+        try:
+            if self.watch:
+                removal_duplicate_file_count = self.run_watch(hasher)
+            elif snapshot is not None:
+                removal_duplicate_file_count = self.run_incremental(hasher, snapshot)
+            elif self.streaming:
+                removal_duplicate_file_count = self.run_streaming(hasher)
+            else:
+                removal_duplicate_file_count = self.run_batch(hasher)
+            finished = True
+        except Cancelled:
+            logger.info('worker cancelled')
+            removal_duplicate_file_count = None
+        finally:
+            hasher.close()
+            if self.executor is not None:
+                # the queued removals are carried out here
+                with measure(self.metrics, 'actions') as stage:
+                    self.executor.close(cancel=self.cancel_token.cancelled)
+                    stage.files += self.executor.done + self.executor.failed
+                logger.info(f'Actions ({self.action}): {self.executor.done} done, {self.executor.failed} failed, '
+                            f'{self.executor.skipped} already linked')
+                logger.info(f'Reclaimed Bytes: {self.executor.bytes_reclaimed}, Trashed Bytes: {self.executor.bytes_trashed}')
+            if cache is not None:
+                logger.info(f'Hash Cache: {cache.hits} hits, {cache.misses} misses')
+                cache.close()
+            if checkpoint is not None:
+                checkpoint.close(finished and not self.cancel_token.cancelled)
+            if snapshot is not None:
+                # the delta is recorded once it was acted on: a dry run, a cancelled or failed run and a failed
+                # action leave it to the next run
+                if finished and not self.dry_run and not self.cancel_token.cancelled and not self.executor.failed:
+                    snapshot.commit()
+                snapshot.close()
+
+        self.removal_count = removal_duplicate_file_count
+        if self.metrics is not None:
+            self.metrics.set('removed', removal_duplicate_file_count or 0)
+            self.metrics.set('hashed_bytes', hasher.bytes_read)
+            if self.executor is not None:
+                self.metrics.set('bytes_reclaimed', self.executor.bytes_reclaimed)
+                self.metrics.set('bytes_trashed', self.executor.bytes_trashed)
+        if removal_duplicate_file_count is not None:
+            logger.info(f'Hashed Bytes: {hasher.bytes_read}')
+            for device_stats in self.scheduler.stats():
+                logger.info(f'Device Stats: {device_stats}')
+            logger.info(f'Removal Duplicate Files: {removal_duplicate_file_count}')
+
+        if self.table_path is not None:
+            export_table(self.groups, self.table_path, self.dry_run)
+            logger.info(f'Duplicate Table: {self.table_path}')
 
-            file_list_temp = np.array_split(file_list, workers)
+        logger.info(f'worker end')
 
-            with Pool(processes=workers) as p:
-                results = list(tqdm(p.imap(lambda x: collect_file_info(x), file_list_temp), total=len(file_list_temp)))
-            files_df = pd.concat(results)
+    def run_batch(self, hasher):
+        from .file_index import FileIndex
+
+        # collect file list into the compact index, with size / dates taken from the walker's stat results
+        with measure(self.metrics, 'walk') as stage:
+            if self.checkpoint is None:
+                records = self.walk(self.walker, *self.roots)
+            else:
+                records = track(self.checkpointed_walk(self.checkpoint), self.progress, self.cancel_token)
+            index = FileIndex.from_records(records)
+            stage.files += len(index)
+        if (len(index) == 0):
+            raise FileNotFoundError(f'Cannot find files in: {self.path}')
 
-        total_files_count = len(files_df)
+        total_files_count = len(index)
+        if self.metrics is not None:
+            self.metrics.set('total_files', total_files_count)
 
         logger.info(f'Total Files: {total_files_count}')
-
-        # find duplicate files by file size
-        duplicate_file_size_df = files_df.groupby('file_size').filter(lambda group: len(group) > 1)
-        duplicate_file_size_count = len(duplicate_file_size_df)
+        logger.info(f'File Index: {index.nbytes / total_files_count:.1f} bytes per file')
+
+        # find duplicate files by file size (or sizes a reference file has), only the candidates become records again
+        with measure(self.metrics, 'size_filter') as stage:
+            references = self.load_references(index.unique_sizes().tolist())
+            size_buckets = index.size_buckets(extra_sizes=references.sizes if references is not None else None)
+            images = self.image_records(index) if self.similar else None
+            duplicate_file_size_count = sum(len(bucket) for bucket in size_buckets.values())
+            stage.files += total_files_count
+            stage.add_candidates(total_files_count, duplicate_file_size_count)
+        del index
+        if (duplicate_file_size_count == 0):
+            logger.info('no duplicate file (by file size) exists')
+            removal_duplicate_file_count = None
+        else:
+            logger.info(f'Duplicate Files by file size: {duplicate_file_size_count}')
+            removal_duplicate_file_count = self.remove_by_digest(size_buckets, hasher, references)
+
+        if images is not None:
+            removal_duplicate_file_count = (removal_duplicate_file_count or 0) + self.remove_similar_images(images, hasher)
+        return removal_duplicate_file_count
+
+    def image_records(self, index):
+        from .perceptual import is_image
+        return [record for record in index.records(range(len(index))) if is_image(record.path)]
+
+    def remove_similar_images(self, images, hasher):
+        from .perceptual import PerceptualHasher
+
+        # exact duplicates were decided first, their removed copies take no part in the near-duplicate search
+        removed = {record.path for group in self.plan.groups for record in group.remove} if self.plan else set()
+        images = [record for record in images if record.path not in removed]
+        perceptual_hasher = PerceptualHasher(self.similar, self.workers, hasher.cache, self.progress, self.cancel_token)
+        plan = self.similar_plan = DedupPlan(self.similar)
+        with measure(self.metrics, 'similar') as stage:
+            groups, loose = perceptual_hasher.similar_groups(images, self.similar_distance)
+            # without remove_similar the groups are reported as what would be removed, never as removed
+            plan.groups.extend(group._replace(report_only=not self.remove_similar) for group in groups)
+            # similar to a group only through its other members, too far from the keeper to be acted on
+            for records in loose:
+                logger.info(f'Similar Images (not within {self.similar_distance} of the keeper, kept): '
+                            f'{[record.path for record in records]}')
+            plan.unverified.extend(loose)
+            stage.files += len(images)
+            stage.add_candidates(len(images), sum(len(group.remove) + 1 for group in plan.groups))
+        logger.info(f'Similar Images ({self.similar}, distance <= {self.similar_distance}): {plan.summary()}')
+
+        removal_count = plan.execute(self.dry_run or not self.remove_similar, self.executor, self.handle_group,
+                                     self.cancel_token)
+        return removal_count if self.remove_similar else 0
+
+    def load_references(self, sizes):
+        """the reference files (walked roots and index entries) that share a size with a target file"""
+        if not self.reference_roots and not self.reference_index:
+            return None
+        from .file_index import FileIndex
+
+        live = {}
+        if self.reference_roots:
+            walker = self.walker
+            live = FileIndex.from_records(self.walk(walker, *self.reference_roots)).select_sizes(sizes)
+
+        indexed = {}
+        head_stage = None
+        if self.reference_index:
+            with ReferenceIndex(self.reference_index) as reference_index:
+                if reference_index.algorithm not in (None, self.stages[-1].algorithm):
+                    raise ValueError(f'{self.reference_index} holds {reference_index.algorithm} digests, '
+                                     f'the last stage uses {self.stages[-1].algorithm}')
+                indexed = reference_index.lookup(sizes)
+                if reference_index.head_matches(self.stages[0]):
+                    head_stage = self.stages[0]
+
+        logger.info(f'Reference Files (same size as a target): {sum(map(len, live.values()))} walked, '
+                    f'{sum(map(len, indexed.values()))} indexed')
+        return References(live, indexed, head_stage)
+
+    def remove_by_digest(self, size_buckets, hasher, references=None):
+        from tqdm import tqdm
+
+        from .grouping import digest_keys, shared_buckets
+
+        # reference files join the size buckets but are protected, a path seen as both stays a reference
+        protected = set()
+        if references is not None:
+            for file_size, refs in references.live.items():
+                protected.update(record.path for record in refs)
+                bucket = size_buckets.setdefault(file_size, [])
+                bucket[:] = [record for record in bucket if record.path not in protected] + refs
+
+        # hash every candidate on the worker pool, one task per file and stage
+        buckets = {file_size: [record.path for record in bucket] for file_size, bucket in size_buckets.items()}
+        keys = {
+            record.path: (record.dev, record.ino, record.size, record.mtime_ns)
+            for bucket in size_buckets.values() for record in bucket
+        }
+        digests = hasher.refine(buckets, keys)
+
+        index_records = []
+        if references is not None and references.indexed:
+            with measure(self.metrics, 'reference_index') as stage:
+                index_records = self.match_reference_index(size_buckets, references, digests, keys, hasher, protected)
+                stage.files += len(index_records)
+        records = [record for bucket in size_buckets.values() for record in bucket if digests.get(record.path) is not None]
+        records.extend(index_records)
+
+        # resolve every duplicate group first (grouped by one sort over (size, digest) byte keys), then act once
+        plan = self.plan = DedupPlan(hasher.algorithm)
+        with measure(self.metrics, 'plan') as stage:
+            if records:
+                _, groups = shared_buckets(digest_keys([record.size for record in records],
+                                                       [digests[record.path] for record in records]))
+                if self.progress is not None:
+                    self.progress.begin('plan', len(groups))
+                show_bar = self.progress_bar and self.progress is None and sys.stderr.isatty()
+                for positions in tqdm(groups, disable=not show_bar):
+                    self.cancel_token.check()
+                    group = [records[i] for i in positions]
+                    plan.add(group, digests[group[0].path], verify=self.verify, protected=protected)
+                    if self.progress is not None:
+                        self.progress.advance(1, 0)
+            # groups that failed verification drop out here
+            stage.files += len(records)
+            stage.add_candidates(len(records), sum(len(group.remove) + 1 for group in plan.groups))
+
+            logger.info(f'Dedup Plan: {plan.summary()}')
+            if self.checkpoint is not None:
+                self.checkpoint.set_phase('act')
+            return plan.execute(self.dry_run, self.executor, self.handle_group, self.cancel_token)
+
+    def match_reference_index(self, size_buckets, references, digests, keys, hasher, protected):
+        """full digests for the target files an index entry may match, returns the index records to group with"""
+        final_stage = self.stages[-1]
+        # targets that refine dropped (alone in their size, or unlike the other targets) can still match an entry
+        items = [(record.path, record.size) for file_size in references.indexed
+                 for record in size_buckets.get(file_size, [])
+                 if record.path not in digests and record.path not in protected]
+
+        if references.head_stage is not None and items:
+            # the head digests in the index rule out most of them with a 4 KB read
+            heads = {(file_size, head) for file_size, entries in references.indexed.items() for _, head, _ in entries}
+            items = [item for item, head in zip(items, hasher.digest_files(references.head_stage, items, keys))
+                     if (item[1], head) in heads]
+
+        digests.update((file_path, digest)
+                       for (file_path, _), digest in zip(items, hasher.digest_files(final_stage, items, keys))
+                       if digest is not None)
+
+        index_records = []
+        for entries in references.indexed.values():
+            for record, _, digest in entries:
+                if record.path in protected:
+                    continue
+                protected.add(record.path)
+                digests[record.path] = digest
+                index_records.append(record)
+        return index_records
+
+    def run_incremental(self, hasher, snapshot):
+
+        # only the delta against the stored tree is listed, it is matched against the stored index by size; the
+        # snapshot update is committed by run_worker
+        with measure(self.metrics, 'snapshot') as stage:
+            self.delta = merge_deltas([snapshot.scan(root, self.walker, commit=False) for root in self.roots])
+            touched = self.delta.new + self.delta.changed
+            stage.files += len(touched)
+        logger.info(f'Snapshot: {self.delta.listed_dirs} dirs listed, {self.delta.skipped_dirs} unchanged')
+        logger.info(f'Delta: {len(self.delta.new)} new, {len(self.delta.changed)} changed, '
+                    f'{len(self.delta.deleted)} deleted')
+        if not touched:
+            logger.info('no new or changed files')
+            return None
+        touched_sizes = {record.size for record in touched}
+        size_buckets = snapshot.same_size(touched_sizes, self.roots)
+
+        references = self.load_references(touched_sizes)
+        reference_sizes = references.sizes if references is not None else set()
+        size_buckets = {
+            file_size: bucket
+            for file_size, bucket in size_buckets.items() if len(bucket) > 1 or file_size in reference_sizes
+        }
+        duplicate_file_size_count = sum(len(bucket) for bucket in size_buckets.values())
         if (duplicate_file_size_count == 0):
             logger.info('no duplicate file (by file size) exists')
-            return
+            return None
 
         logger.info(f'Duplicate Files by file size: {duplicate_file_size_count}')
+        return self.remove_by_digest(size_buckets, hasher, references)
 
-        # remove duplicate files by file md5
+    def run_streaming(self, hasher):
 
-        duplicate_file_size_group = duplicate_file_size_df.groupby('file_size')
+        # walk, hash and remove in one pass, only same-size candidates are kept in memory
+        walker = self.walker
+        dedup = StreamingDeduplicator(hasher)
 
-        removal_duplicate_file_count = 0
+        total_files_count = 0
 
-        for duplicate_file_size_df in tqdm(duplicate_file_size_group):
-            removal_duplicate_file_count += remove_duplicate_files_by_md5(duplicate_file_size_df)
+        def counted(records):
+            nonlocal total_files_count
+            for record in records:
+                total_files_count += 1
+                yield record
 
-        logger.info(f'Removal Duplicate Files: {removal_duplicate_file_count}')
+        # the walk and the hash stages interleave, the hash stages are also reported on their own
+        with measure(self.metrics, 'streaming') as stage:
+            removal_duplicate_file_count = self.remove_groups(dedup, dedup.feed(counted(self.walk(walker, *self.roots))))
+            stage.files += total_files_count
+            stage.add_candidates(total_files_count, dedup.candidate_count)
+        if self.metrics is not None:
+            self.metrics.set('total_files', total_files_count)
 
-        # NUM_USABLE_CPU = max(multiprocessing.cpu_count() - 2, 1)
-        # workers = min(NUM_USABLE_CPU, len(duplicate_file_size_group))
+        if (total_files_count == 0):
+            raise FileNotFoundError(f'Cannot find files in: {self.path}')
 
-        # with Pool(processes=workers) as p:
-        #     results = list(
-        #         tqdm(p.imap(lambda x: remove_duplicate_files_by_md5(x), duplicate_file_size_group),
-        #              total=len(duplicate_file_size_group),
-        #              ncols=80))
+        logger.info(f'Total Files: {total_files_count}')
+        logger.info(f'Duplicate Candidates: {dedup.candidate_count}')
 
-        logger.info(f'worker end')
+        return removal_duplicate_file_count
+
+    def remove_groups(self, dedup, groups, removed=None):
+        """act on the groups a StreamingDeduplicator emits, the paths removed are collected in removed"""
+        removal_duplicate_file_count = 0
+        group_removed = []
+
+        def on_group(group):
+            group_removed.extend(record.path for record in group.remove)
+            self.handle_group(group)
+
+        for group in groups:
+            logger.info(f'Duplicate Group: {group.digest} ({len(group.records)} files, {group.size} bytes)')
+            removal_duplicate_file_count += remove_duplicate_records(group.records, group.digest, group.algorithm,
+                                                                     self.verify, self.dry_run, on_group, self.executor)
+            # removed files must not be picked as keeper (or reported again) when the group grows later
+            dedup.discard(group_removed)
+            if removed is not None:
+                removed.extend(group_removed)
+            group_removed.clear()
+
+        return removal_duplicate_file_count
+
+    def run_watch(self, hasher):
+
+        # live index: size -> candidates and digest -> paths of the StreamingDeduplicator, fed by fs events
+        walker = self.walker
+        dedup = StreamingDeduplicator(hasher)
+        watcher = make_watcher(walker, self.watch_interval)
+        debouncer = Debouncer(self.debounce)
+        indexed = {}
+        # paths our own actions removed or replaced, their events are not new files
+        acted = set()
+        removal_duplicate_file_count = 0
+
+        def classify(records):
+            nonlocal removal_duplicate_file_count
+            for record in records:
+                indexed[record.path] = record
+            removed = []
+            removal_duplicate_file_count += self.remove_groups(dedup, dedup.feed(records), removed)
+            for file_path in removed:
+                indexed.pop(file_path, None)
+            if not self.dry_run:
+                acted.update(removed)
+
+        try:
+            for root in self.roots:
+                classify(watcher.add_tree(root))
+            logger.info(f'Watching: {self.path} ({type(watcher).__name__}, {len(indexed)} files indexed)')
+
+            while not self.cancel_token.cancelled:
+                for kind, file_path in watcher.read(debouncer.timeout()):
+                    if kind == 'rescan':
+                        # events were lost, compare the whole tree against the index
+                        for record in walker.walk(file_path):
+                            if indexed.get(record.path) != record:
+                                debouncer.add('write', record.path)
+                    else:
+                        debouncer.add(kind, file_path)
+
+                records = []
+                for kind, file_path in debouncer.due():
+                    if kind == 'delete_dir':
+                        prefix = file_path + os.sep
+                        for path in [path for path in indexed if path.startswith(prefix)]:
+                            dedup.remove(indexed.pop(path))
+                        continue
+                    if file_path in acted:
+                        acted.discard(file_path)
+                        continue
+                    record = None
+                    if kind != 'delete':
+                        try:
+                            record = walker.stat_file(file_path)
+                        except OSError:
+                            pass
+                    old = indexed.get(file_path)
+                    if old is not None and old == record:
+                        continue
+                    if old is not None:
+                        dedup.remove(indexed.pop(file_path))
+                    if record is not None:
+                        records.append(record)
+                if records:
+                    classify(records)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+        logger.info(f'watch stopped: {len(indexed)} files indexed')
+        return removal_duplicate_file_count
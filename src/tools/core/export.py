@@ -0,0 +1,33 @@
+import os
+
+TABLE_COLUMNS = [
+    'digest', 'algorithm', 'action', 'file_path', 'file_size', 'create_date', 'modify_date', 'dev', 'ino', 'mtime_ns'
+]
+
+
+def groups_to_dataframe(groups, dry_run=False):
+    """one row per file of every DuplicateFiles group, the only place the engine needs pandas"""
+    import pandas as pd
+
+    rows = []
+    for group in groups:
+        removal_action = 'would_remove' if dry_run or group.report_only else 'remove'
+        for action, records in (('keep', [group.keep]), (removal_action, group.remove)):
+            for r in records:
+                rows.append((group.digest, group.algorithm, action, r.path, r.size, r.ctime, r.mtime, r.dev, r.ino,
+                             r.mtime_ns))
+    return pd.DataFrame.from_records(rows, columns=TABLE_COLUMNS)
+
+
+def export_table(groups, table_path, dry_run=False):
+    df = groups_to_dataframe(groups, dry_run)
+    ext = os.path.splitext(table_path)[1].lower()
+    if ext == '.parquet':
+        df.to_parquet(table_path, index=False)
+    elif ext in ('.pkl', '.pickle'):
+        df.to_pickle(table_path)
+    elif ext == '.xlsx':
+        df.to_excel(table_path, index=False)
+    else:
+        df.to_csv(table_path, index=False)
+    return df
@@ -0,0 +1,237 @@
+import os
+import sys
+
+import numpy as np
+
+from .grouping import shared_buckets
+from .walker import FileRecord
+
+# struct of arrays, one element per file; the path is split into an interned directory and a basename
+FIELDS = [
+    ('size', np.int64),
+    ('mtime', np.float64),
+    ('ctime', np.float64),
+    ('ino', np.uint64),
+    ('dev', np.uint64),
+    ('mtime_ns', np.int64),
+    ('dir_id', np.int32),
+    ('name_end', np.int64),
+]
+
+# records are buffered and moved into the arrays in chunks, element-wise numpy writes are slow
+CHUNK_SIZE = 64 * 1024
+
+
+class FileView():
+    """one file of a FileIndex, read through on every attribute access"""
+    __slots__ = ('index', 'i')
+
+    def __init__(self, index, i):
+        self.index = index
+        self.i = i
+
+    @property
+    def path(self):
+        return self.index.path(self.i)
+
+    @property
+    def size(self):
+        return int(self.index.size[self.i])
+
+    @property
+    def ino(self):
+        return int(self.index.ino[self.i])
+
+    @property
+    def dev(self):
+        return int(self.index.dev[self.i])
+
+    @property
+    def mtime(self):
+        return float(self.index.mtime[self.i])
+
+    @property
+    def ctime(self):
+        return float(self.index.ctime[self.i])
+
+    @property
+    def mtime_ns(self):
+        return int(self.index.mtime_ns[self.i])
+
+    def record(self):
+        return self.index.record(self.i)
+
+    def __repr__(self):
+        return f'FileView({self.path!r}, size={self.size})'
+
+
+class FileIndex():
+    """compact file index: numpy columns for size / mtime / ctime / ino / dev / mtime_ns, directories
+    interned once, basenames packed into one bytes buffer
+
+    about 60 bytes plus the basename per file, against several hundred for a FileRecord or a DataFrame
+    row with an object path column. only the candidates of a size bucket become FileRecords again.
+    """
+    def __init__(self, capacity=1024):
+        self.count = 0
+        self.capacity = capacity
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in FIELDS}
+        self.names = bytearray()
+        self.dirs = []
+        self.dir_prefixes = []
+        self.dir_ids = {}
+        self._pending = []
+
+    @classmethod
+    def from_records(cls, records):
+        index = cls()
+        index.extend(records)
+        return index
+
+    def __getattr__(self, name):
+        # index.size, index.mtime, ... are the filled part of each column
+        columns = self.__dict__.get('columns')
+        if columns is None or name not in columns:
+            raise AttributeError(name)
+        self.flush()
+        return columns[name][:self.count]
+
+    def __len__(self):
+        return self.count + len(self._pending)
+
+    def __getitem__(self, i):
+        self.flush()
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return FileView(self, i)
+
+    def __iter__(self):
+        self.flush()
+        return (FileView(self, i) for i in range(self.count))
+
+    def _dir_id(self, dir_path):
+        dir_id = self.dir_ids.get(dir_path)
+        if dir_id is None:
+            dir_id = self.dir_ids[dir_path] = len(self.dirs)
+            self.dirs.append(dir_path)
+            self.dir_prefixes.append(os.path.join(dir_path, ''))
+        return dir_id
+
+    def append(self, record):
+        self._pending.append(record)
+        if len(self._pending) >= CHUNK_SIZE:
+            self.flush()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+        self.flush()
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        if capacity != self.capacity:
+            for name, column in self.columns.items():
+                grown = np.empty(capacity, dtype=column.dtype)
+                grown[:self.count] = column[:self.count]
+                self.columns[name] = grown
+            self.capacity = capacity
+
+    def flush(self):
+        rows = self._pending
+        if not rows:
+            return
+        self._pending = []
+        n = len(rows)
+        start = self.count
+        self._grow(start + n)
+
+        columns = self.columns
+        for name, dtype in FIELDS[:6]:
+            columns[name][start:start + n] = np.fromiter((getattr(r, name) for r in rows), dtype=dtype, count=n)
+
+        dir_ids = columns['dir_id']
+        name_ends = columns['name_end']
+        names = self.names
+        # walker records come directory by directory, remember the last directory instead of hashing it again
+        last_dir = None
+        last_id = -1
+        for j, record in enumerate(rows, start):
+            dir_path, base_name = os.path.split(record.path)
+            if dir_path != last_dir:
+                last_dir = dir_path
+                last_id = self._dir_id(dir_path)
+            dir_ids[j] = last_id
+            names += os.fsencode(base_name)
+            name_ends[j] = len(names)
+        self.count += n
+
+    def path(self, i):
+        name_ends = self.columns['name_end']
+        start = int(name_ends[i - 1]) if i > 0 else 0
+        base_name = self.names[start:int(name_ends[i])].decode(sys.getfilesystemencoding(), 'surrogateescape')
+        return self.dir_prefixes[self.columns['dir_id'][i]] + base_name
+
+    def record(self, i):
+        columns = self.columns
+        return FileRecord(self.path(i), int(columns['size'][i]), int(columns['ino'][i]), int(columns['dev'][i]),
+                          float(columns['mtime'][i]), float(columns['ctime'][i]), int(columns['mtime_ns'][i]))
+
+    def records(self, indices):
+        """FileRecords of many files at once, the columns are gathered with one fancy index each"""
+        self.flush()
+        indices = np.asarray(indices, dtype=np.int64)
+        columns = self.columns
+        name_ends = columns['name_end']
+        ends = name_ends[indices].tolist()
+        starts = np.where(indices > 0, name_ends[indices - 1], 0).tolist()
+        names = self.names
+        prefixes = self.dir_prefixes
+        encoding = sys.getfilesystemencoding()
+        paths = [
+            prefixes[dir_id] + names[start:end].decode(encoding, 'surrogateescape')
+            for dir_id, start, end in zip(columns['dir_id'][indices].tolist(), starts, ends)
+        ]
+        return list(
+            map(FileRecord._make,
+                zip(paths, columns['size'][indices].tolist(), columns['ino'][indices].tolist(),
+                    columns['dev'][indices].tolist(), columns['mtime'][indices].tolist(),
+                    columns['ctime'][indices].tolist(), columns['mtime_ns'][indices].tolist())))
+
+    def _buckets(self, sizes, positions):
+        # one gather for all candidates, then cut it into buckets
+        records = self.records(np.concatenate(positions)) if positions else []
+        buckets = {}
+        offset = 0
+        for size, bucket in zip(sizes.tolist(), positions):
+            buckets[size] = records[offset:offset + len(bucket)]
+            offset += len(bucket)
+        return buckets
+
+    def size_buckets(self, min_count=2, extra_sizes=None):
+        """{size: [FileRecord]} for every size shared by at least min_count files (or listed in extra_sizes)"""
+        self.flush()
+        if extra_sizes is None:
+            return self._buckets(*shared_buckets(self.size, min_count))
+        sizes, positions = shared_buckets(self.size, 1)
+        keep = np.isin(sizes, np.fromiter(extra_sizes, dtype=np.int64))
+        keep |= np.fromiter((len(bucket) >= min_count for bucket in positions), dtype=bool, count=len(positions))
+        return self._buckets(sizes[keep], [bucket for bucket, kept in zip(positions, keep) if kept])
+
+    def select_sizes(self, sizes):
+        """{size: [FileRecord]} of the files whose size is in sizes"""
+        return self.size_buckets(min_count=len(self) + 1, extra_sizes=sizes)
+
+    def unique_sizes(self):
+        return np.unique(self.size)
+
+    @property
+    def nbytes(self):
+        """memory held by the index (filled part of the columns, names, interned directories)"""
+        self.flush()
+        column_bytes = sum(column.itemsize * self.count for column in self.columns.values())
+        dir_bytes = sum(sys.getsizeof(dir_path) * 2 for dir_path in self.dirs) + sys.getsizeof(self.dir_ids)
+        return column_bytes + len(self.names) + dir_bytes
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+def shared_buckets(keys, min_count=2):
+    """group the positions of equal keys with one stable sort, no Python call per group
+
+    returns (keys, [positions]) for the keys found at least min_count times, in key order
+    """
+    keys = np.asarray(keys)
+    order = np.argsort(keys, kind='stable')
+    unique_keys, counts = np.unique(keys[order], return_counts=True)
+    shared = counts >= min_count
+    positions = order[np.repeat(shared, counts)]
+    return unique_keys[shared], np.split(positions, np.cumsum(counts[shared])[:-1]) if shared.any() else []
+
+
+def duplicated_mask(keys):
+    """True where the key occurs more than once, the same as pandas duplicated(keep=False)"""
+    keys = np.asarray(keys)
+    mask = np.zeros(len(keys), dtype=bool)
+    if len(keys) < 2:
+        return mask
+    order = np.argsort(keys, kind='stable')
+    same = keys[order][1:] == keys[order][:-1]
+    sorted_mask = np.zeros(len(keys), dtype=bool)
+    sorted_mask[1:] |= same
+    sorted_mask[:-1] |= same
+    mask[order] = sorted_mask
+    return mask
+
+
+def digest_keys(sizes, digests):
+    """size and hex digest packed into one fixed-width bytes key per file (8 + digest length / 2 bytes)
+
+    the keys compare with memcmp instead of as Python strings, and take half the room of the hex text
+    """
+    count = len(digests)
+    width = len(digests[0]) // 2 if count else 0
+    if any(len(digest) != width * 2 for digest in digests):
+        # mixed algorithms, pad to the longest
+        keys = [file_size.to_bytes(8, 'big') + bytes.fromhex(digest) for file_size, digest in zip(sizes, digests)]
+        return np.array(keys, dtype=f'S{max(len(key) for key in keys)}')
+    # one hex decode for all digests, the sizes as big-endian bytes in front
+    columns = np.empty((count, 8 + width), dtype=np.uint8)
+    columns[:, :8] = np.asarray(sizes, dtype='>i8').view(np.uint8).reshape(count, 8)
+    columns[:, 8:] = np.frombuffer(bytes.fromhex(''.join(digests)), dtype=np.uint8).reshape(count, width)
+    return columns.view(f'S{8 + width}').ravel()
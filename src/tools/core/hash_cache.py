@@ -0,0 +1,167 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.duplicate_file_removal', 'hash_cache.db')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS digests (
+    dev INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    algorithm TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (dev, ino, size, mtime_ns, stage, algorithm)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS digests_last_used ON digests (last_used);
+'''
+
+
+def cache_key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class HashCache():
+    """persistent (dev, ino, size, mtime_ns, stage, algorithm) -> digest store, SQLite in WAL mode
+
+    a file that changes gets a new size / mtime_ns and simply misses, stale rows of the same inode are
+    replaced on the next put. writes and LRU touches are buffered and flushed in batches.
+    """
+    def __init__(self, db_path=DEFAULT_CACHE_PATH, batch_size=1000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._pending = []
+        self._touched = []
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+
+    def get(self, key, stage, algorithm):
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT digest FROM digests WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND stage=? AND algorithm=?',
+                (*key, stage, algorithm)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched.append((*key, stage, algorithm))
+            if len(self._touched) >= self.batch_size:
+                self._flush()
+            return row[0]
+
+    def put(self, key, stage, algorithm, digest):
+        with self._lock:
+            self._pending.append((*key, stage, algorithm, digest))
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        now = time.time()
+        with self.conn:
+            if self._pending:
+                # the inode was rewritten since its rows were stored
+                self.conn.executemany('DELETE FROM digests WHERE dev=? AND ino=? AND (size!=? OR mtime_ns!=?)',
+                                      [row[:4] for row in self._pending])
+                self.conn.executemany('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                      [(*row, now) for row in self._pending])
+            if self._touched:
+                self.conn.executemany(
+                    'UPDATE digests SET last_used=? '
+                    'WHERE dev=? AND ino=? AND size=? AND mtime_ns=? AND stage=? AND algorithm=?',
+                    [(now, *row) for row in self._touched])
+        self._pending = []
+        self._touched = []
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def invalidate(self, file_path):
+        st = os.stat(file_path)
+        with self._lock:
+            self._flush()
+            with self.conn:
+                return self.conn.execute('DELETE FROM digests WHERE dev=? AND ino=?', (st.st_dev, st.st_ino)).rowcount
+
+    def evict(self, max_age=None, max_entries=None):
+        """drop rows unused for max_age seconds, then the least recently used rows beyond max_entries"""
+        removed = 0
+        with self._lock:
+            self._flush()
+            with self.conn:
+                if max_age is not None:
+                    removed += self.conn.execute('DELETE FROM digests WHERE last_used < ?',
+                                                 (time.time() - max_age, )).rowcount
+                if max_entries is not None:
+                    count = self.conn.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+                    removed += self.conn.execute(
+                        'DELETE FROM digests WHERE (dev, ino, size, mtime_ns, stage, algorithm) IN '
+                        '(SELECT dev, ino, size, mtime_ns, stage, algorithm FROM digests ORDER BY last_used LIMIT ?)',
+                        (max(count - max_entries, 0), )).rowcount
+        return removed
+
+    def vacuum(self, max_age=None, max_entries=None):
+        removed = self.evict(max_age, max_entries)
+        with self._lock:
+            self.conn.execute('VACUUM')
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return removed
+
+    def stats(self):
+        with self._lock:
+            self._flush()
+            count = self.conn.execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+        return {'entries': count, 'hits': self.hits, 'misses': self.misses, 'size': os.path.getsize(self.db_path)}
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='maintain the persistent hash cache')
+    parser.add_argument('command', choices=['stats', 'evict', 'vacuum', 'invalidate'])
+    parser.add_argument('paths', nargs='*', help='files to invalidate')
+    parser.add_argument('--db', default=DEFAULT_CACHE_PATH)
+    parser.add_argument('--max-age-days', type=float)
+    parser.add_argument('--max-entries', type=int)
+    args = parser.parse_args(argv)
+
+    max_age = None if args.max_age_days is None else args.max_age_days * 86400
+
+    with HashCache(args.db) as cache:
+        if args.command == 'stats':
+            logger.info(cache.stats())
+        elif args.command == 'evict':
+            logger.info(f'evicted {cache.evict(max_age, args.max_entries)} entries')
+        elif args.command == 'vacuum':
+            logger.info(f'evicted {cache.vacuum(max_age, args.max_entries)} entries, {cache.stats()}')
+        else:
+            for file_path in args.paths:
+                logger.info(f'{file_path}: {cache.invalidate(file_path)} entries removed')
+
+
+if __name__ == '__main__':
+    main()
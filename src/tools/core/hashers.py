@@ -0,0 +1,75 @@
+import hashlib
+import zlib
+
+_HASHERS = {}
+
+
+class Crc32():
+    """hashlib-like wrapper around zlib.crc32, a stdlib prefilter when xxhash is not installed"""
+    name = 'crc32'
+    digest_size = 4
+
+    def __init__(self, data=b''):
+        self.value = zlib.crc32(data)
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def digest(self):
+        return self.value.to_bytes(4, 'big')
+
+    def hexdigest(self):
+        return f'{self.value:08x}'
+
+
+def register_hasher(name, factory, cryptographic=False):
+    """factory() must return a fresh object with update / digest / hexdigest"""
+    _HASHERS[name] = (factory, cryptographic)
+
+
+def get_hasher(name):
+    try:
+        factory, _ = _HASHERS[name]
+    except KeyError:
+        raise ValueError(f'unknown hash algorithm: {name}, available: {", ".join(available_hashers())}') from None
+    return factory()
+
+
+def is_cryptographic(name):
+    return _HASHERS[name][1]
+
+
+def available_hashers():
+    return list(_HASHERS)
+
+
+def pick_hasher(*names):
+    # first registered name wins, so optional backends can be listed before their stdlib fallbacks
+    for name in names:
+        if name in _HASHERS:
+            return name
+    raise ValueError(f'none of these hash algorithms is available: {", ".join(names)}')
+
+
+register_hasher('crc32', Crc32)
+register_hasher('md5', hashlib.md5, cryptographic=True)
+register_hasher('sha1', hashlib.sha1, cryptographic=True)
+register_hasher('sha256', hashlib.sha256, cryptographic=True)
+register_hasher('blake2b', hashlib.blake2b, cryptographic=True)
+
+try:
+    import xxhash
+    register_hasher('xxh64', xxhash.xxh64)
+    register_hasher('xxh3_64', xxhash.xxh3_64)
+    register_hasher('xxh3_128', xxhash.xxh3_128)
+except ImportError:
+    pass
+
+try:
+    import blake3
+    register_hasher('blake3', blake3.blake3, cryptographic=True)
+except ImportError:
+    pass
+
+FAST_HASHER = pick_hasher('xxh3_64', 'crc32')
+STRONG_HASHER = pick_hasher('blake3', 'blake2b')
@@ -0,0 +1,43 @@
+import hashlib
+
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+
+class HashEngine():
+    """streaming file hasher, reuses one preallocated buffer for every read"""
+    def __init__(self, buffer_size=DEFAULT_BUFFER_SIZE):
+        if buffer_size <= 0:
+            raise ValueError(f'buffer_size must be positive: {buffer_size}')
+        self.buffer_size = buffer_size
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.bytes_read = 0
+
+    def update_from(self, hash_obj, f, length=None):
+        # feed up to length bytes (or the rest of the file) from the current position
+        view = self.view
+        buffer_size = self.buffer_size
+        remaining = length
+        while remaining is None or remaining > 0:
+            if remaining is not None and remaining < buffer_size:
+                n = f.readinto(view[:remaining])
+            else:
+                n = f.readinto(view)
+            if not n:
+                break
+            hash_obj.update(view[:n])
+            self.bytes_read += n
+            if remaining is not None:
+                remaining -= n
+        return hash_obj
+
+    def hash_file(self, file_path, hash_obj=None):
+        if hash_obj is None:
+            hash_obj = hashlib.md5()
+        with open(file_path, 'rb', buffering=0) as f:
+            self.update_from(hash_obj, f)
+        return hash_obj.hexdigest()
+
+
+def calc_md5(file_path, buffer_size=DEFAULT_BUFFER_SIZE):
+    return HashEngine(buffer_size).hash_file(file_path, hashlib.md5())
@@ -0,0 +1,132 @@
+import os
+import struct
+from collections import deque
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# linux/fs.h and linux/fiemap.h
+FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HEADER = struct.Struct('=QQIIII')
+_FIEMAP_EXTENT = struct.Struct('=QQQQQIIII')
+
+UNKNOWN_DEVICE = -1
+
+
+def physical_offset(file_path):
+    """physical byte offset of the first extent (FIEMAP), None when the platform or filesystem cannot tell"""
+    if fcntl is None:
+        return None
+    request = bytearray(_FIEMAP_HEADER.pack(0, 0xFFFFFFFFFFFFFFFF, 0, 0, 1, 0) + bytes(_FIEMAP_EXTENT.size))
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+    mapped_extents = _FIEMAP_HEADER.unpack_from(request)[3]
+    if mapped_extents == 0:
+        return None
+    return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP_HEADER.size)[1]
+
+
+def is_rotational(dev):
+    """True for spinning disks, False for SSDs, None when unknown (non-linux, network or virtual filesystems)"""
+    if dev == UNKNOWN_DEVICE:
+        return None
+    block = f'/sys/dev/block/{os.major(dev)}:{os.minor(dev)}'
+    # partitions keep queue/ on their parent disk
+    for queue in (os.path.join(block, 'queue', 'rotational'), os.path.join(block, '..', 'queue', 'rotational')):
+        try:
+            with open(queue) as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+
+class DeviceStats():
+    __slots__ = ('dev', 'files', 'bytes', 'busy', 'first_start', 'last_end')
+
+    def __init__(self, dev):
+        self.dev = dev
+        self.files = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    @property
+    def throughput(self):
+        # bytes per second of wall time while the device had work in flight
+        if self.first_start is None or self.last_end <= self.first_start:
+            return 0.0
+        return self.bytes / (self.last_end - self.first_start)
+
+    def as_dict(self):
+        return {
+            'dev': self.dev,
+            'files': self.files,
+            'bytes': self.bytes,
+            'busy_seconds': round(self.busy, 3),
+            'mb_per_second': round(self.throughput / (1024 * 1024), 2),
+        }
+
+
+class IOScheduler():
+    """per st_dev read queues with their own concurrency limit
+
+    spinning disks get hdd_limit concurrent reads and every queue is sorted by inode (or physical offset,
+    order='offset') so reads on one disk are close to sequential; SSDs get ssd_limit. devices that cannot tell
+    (network and virtual filesystems) get unknown_limit, the hasher's worker count is a good one, ssd_limit
+    when it is not given.
+    """
+    def __init__(self, ssd_limit=8, hdd_limit=1, limits=None, order='inode', unknown_limit=None):
+        if order not in ('inode', 'offset', None):
+            raise ValueError(f'unknown order: {order}')
+        self.ssd_limit = max(ssd_limit, 1)
+        self.hdd_limit = max(hdd_limit, 1)
+        self.unknown_limit = self.ssd_limit if unknown_limit is None else max(unknown_limit, 1)
+        self.limits = dict(limits or {})
+        self.order = order
+        self.devices = {}
+
+    def limit(self, dev):
+        if dev not in self.limits:
+            rotational = is_rotational(dev)
+            self.limits[dev] = self.unknown_limit if rotational is None else self.hdd_limit if rotational else self.ssd_limit
+        return self.limits[dev]
+
+    def plan(self, items, keys):
+        """split (index, file_path, file_size) items into {dev: deque} ordered for reading"""
+        queues = {}
+        for item in items:
+            key = keys.get(item[1])
+            dev = UNKNOWN_DEVICE if key is None else key[0]
+            queues.setdefault(dev, []).append(item)
+
+        for dev, queue in queues.items():
+            if self.order == 'offset':
+                offsets = {item[1]: physical_offset(item[1]) for item in queue}
+                queue.sort(key=lambda item: (offsets[item[1]] is None, offsets[item[1]] or 0))
+            elif self.order == 'inode':
+                queue.sort(key=lambda item: keys[item[1]][1] if item[1] in keys else 0)
+            queues[dev] = deque(queue)
+        return queues
+
+    def record(self, dev, bytes_read, start, end):
+        stats = self.devices.get(dev)
+        if stats is None:
+            stats = self.devices[dev] = DeviceStats(dev)
+        stats.files += 1
+        stats.bytes += bytes_read
+        stats.busy += end - start
+        stats.first_start = start if stats.first_start is None else min(stats.first_start, start)
+        stats.last_end = end if stats.last_end is None else max(stats.last_end, end)
+
+    def stats(self):
+        return [stats.as_dict() for stats in self.devices.values()]
@@ -0,0 +1,280 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+from loguru import logger
+
+PROFILERS = ['cprofile', 'sample']
+# seconds between two stack samples of the sampling profiler
+SAMPLE_INTERVAL = 0.005
+# /proc/self/io fields, the kernel's count of read / write calls and the bytes they asked for
+PROC_IO_FIELDS = {'syscr': 'read_syscalls', 'syscw': 'write_syscalls', 'rchar': 'read_chars'}
+
+
+def proc_io():
+    try:
+        with open('/proc/self/io') as f:
+            rows = dict(line.split(':', 1) for line in f)
+    except (OSError, ValueError):
+        return {}
+    return {name: int(rows[field]) for field, name in PROC_IO_FIELDS.items() if field in rows}
+
+
+class StageMetrics():
+    """what one stage did, a stage that runs more than once (a refine per streamed group) adds up
+
+    candidates_in / candidates_out are set by filter stages: the files they were given and the ones that
+    still collide afterwards
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.files = 0
+        self.candidates_in = None
+        self.candidates_out = None
+        self.counters = Counter()
+        self.profile_path = None
+
+    def add_candidates(self, candidates_in, candidates_out):
+        self.candidates_in = (self.candidates_in or 0) + candidates_in
+        self.candidates_out = (self.candidates_out or 0) + candidates_out
+
+    def as_dict(self):
+        values = {
+            'stage': self.name,
+            'calls': self.calls,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'files': self.files,
+        }
+        if self.candidates_in is not None:
+            values['candidates_in'] = self.candidates_in
+            values['candidates_out'] = self.candidates_out
+            values['eliminated'] = self.candidates_in - self.candidates_out
+        values.update(self.counters)
+        lookups = self.counters.get('cache_hits', 0) + self.counters.get('cache_misses', 0)
+        if lookups:
+            values['cache_hit_ratio'] = self.counters['cache_hits'] / lookups
+        if self.profile_path is not None:
+            values['profile'] = self.profile_path
+        return values
+
+
+class SamplingProfiler():
+    """samples the stacks of every thread, unlike cProfile it also sees the hashing and walker pools
+
+    writes collapsed stacks (one 'frame;frame;frame count' line per stack) for flamegraph tools
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        # may be started again, the samples add up
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        own = threading.get_ident()
+        stop = self._stop
+        while not stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, file_path):
+        with open(file_path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+class MetricsRecorder():
+    """per-stage wall / CPU time and counter deltas of one run, handed to the sinks by emit()
+
+    counters are callables sampled when a stage begins and ends (bytes read, cache hits, stat calls), the
+    read / write syscall counts come from /proc/self/io where it exists. stages may nest, the outer one
+    includes the inner ones; only the outermost stage is profiled. CPU time is the whole process's.
+    """
+    def __init__(self, sinks=(), profiler=None, profile_dir=None):
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f'unknown profiler: {profiler}, available: {", ".join(PROFILERS)}')
+        self.sinks = list(sinks)
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.counters = {}
+        self.stages = {}
+        self.values = {}
+        # stage name -> profiler, a stage that runs again keeps adding to its profile
+        self.profiles = {}
+        self.started = time.time()
+        self.depth = 0
+
+    def add_counter(self, name, func):
+        self.counters[name] = func
+
+    def set(self, name, value):
+        # run level values: total files, removed files
+        self.values[name] = value
+
+    def sample(self):
+        values = proc_io()
+        for name, func in self.counters.items():
+            values[name] = func()
+        return values
+
+    @contextmanager
+    def stage(self, name):
+        metrics = self.stages.get(name)
+        if metrics is None:
+            metrics = self.stages[name] = StageMetrics(name)
+        profiler = self.start_profiler(name) if self.depth == 0 and self.profiler is not None else None
+        self.depth += 1
+        before = self.sample()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield metrics
+        finally:
+            metrics.wall_seconds += time.perf_counter() - wall
+            metrics.cpu_seconds += time.process_time() - cpu
+            metrics.calls += 1
+            after = self.sample()
+            for counter, value in after.items():
+                metrics.counters[counter] += value - before.get(counter, 0)
+            self.depth -= 1
+            if profiler is not None:
+                if self.profiler == 'cprofile':
+                    profiler.disable()
+                else:
+                    profiler.stop()
+
+    def start_profiler(self, name):
+        profiler = self.profiles.get(name)
+        if self.profiler == 'cprofile':
+            if profiler is None:
+                import cProfile
+                profiler = self.profiles[name] = cProfile.Profile()
+            profiler.enable()
+        else:
+            if profiler is None:
+                profiler = self.profiles[name] = SamplingProfiler()
+            profiler.start()
+        return profiler
+
+    def dump_profiles(self):
+        # pstats files for cProfile (snakeviz, python -m pstats), collapsed stacks for the sampler
+        profile_dir = self.profile_dir or '.'
+        os.makedirs(profile_dir, exist_ok=True)
+        started = time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started)) + f'.{int(self.started * 1000) % 1000:03d}'
+        prefix = os.path.join(profile_dir, started)
+        for name, profiler in self.profiles.items():
+            if self.profiler == 'cprofile':
+                file_path = f'{prefix}-{name}.prof'
+                profiler.dump_stats(file_path)
+            else:
+                file_path = f'{prefix}-{name}.folded'
+                profiler.dump(file_path)
+            self.stages[name].profile_path = file_path
+
+    def report(self):
+        return {
+            'started': self.started,
+            'wall_seconds': time.time() - self.started,
+            **self.values,
+            'stages': [metrics.as_dict() for metrics in self.stages.values()],
+        }
+
+    def emit(self):
+        if self.profiles:
+            self.dump_profiles()
+        report = self.report()
+        for sink in self.sinks:
+            try:
+                sink.write(report)
+            except Exception as ex:
+                logger.info(f'metrics sink {type(sink).__name__} failed: {ex}')
+        return report
+
+
+def measure(metrics, name):
+    """metrics.stage(name), or a stage nobody looks at when there is no recorder"""
+    return nullcontext(StageMetrics(name)) if metrics is None else metrics.stage(name)
+
+
+class LogSink():
+    """one log line per stage, counters that stayed at 0 are left out"""
+    def write(self, report):
+        for stage in report['stages']:
+            details = ', '.join(f'{name}={value:.3f}' if isinstance(value, float) else f'{name}={value}'
+                                for name, value in stage.items() if name != 'stage' and value != 0)
+            logger.info(f'Stage {stage["stage"]}: {details}')
+
+
+class JsonLinesSink():
+    """the report of every run appended to a JSON lines file"""
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def write(self, report):
+        directory = os.path.dirname(os.path.abspath(self.file_path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.file_path, 'a') as f:
+            f.write(json.dumps(report, ensure_ascii=False) + '\n')
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class PrometheusTextfileSink():
+    """the last run in the node_exporter textfile collector format
+
+    written to a temporary file and renamed, so a scrape never reads half a file
+    """
+    def __init__(self, file_path, prefix='dfr'):
+        self.file_path = file_path
+        self.prefix = prefix
+
+    def write(self, report):
+        lines = []
+        for name, value in report.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                metric = f'{self.prefix}_run_{name}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {value}')
+
+        names = []
+        for stage in report['stages']:
+            for name in stage:
+                if name not in names and name not in ('stage', 'profile'):
+                    names.append(name)
+        for name in names:
+            metric = f'{self.prefix}_stage_{name}'
+            lines.append(f'# TYPE {metric} gauge')
+            for stage in report['stages']:
+                if name in stage:
+                    lines.append(f'{metric}{{stage="{_label(stage["stage"])}"}} {stage[name]}')
+
+        temp_path = f'{self.file_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(temp_path, self.file_path)
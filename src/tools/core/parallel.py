@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from loguru import logger
+
+from .hashing import DEFAULT_BUFFER_SIZE, HashEngine
+from .io_scheduler import UNKNOWN_DEVICE
+from .stages import DEFAULT_STAGES, StagedHasher, stage_digest
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+_process_engine = None
+
+
+def _timed_stage_digest(engine, stage, file_path, file_size):
+    before = engine.bytes_read
+    start = time.time()
+    digest = stage_digest(engine, stage, file_path, file_size)
+    return digest, engine.bytes_read - before, start, time.time()
+
+
+def _process_stage_digest(stage, file_path, file_size, buffer_size):
+    # one engine (and buffer) per worker process
+    global _process_engine
+    if _process_engine is None or _process_engine.buffer_size != buffer_size:
+        _process_engine = HashEngine(buffer_size)
+    return _timed_stage_digest(_process_engine, stage, file_path, file_size)
+
+
+class ParallelHasher(StagedHasher):
+    """StagedHasher that hashes every file of a stage as its own task on a worker pool
+
+    threads are the default, hashlib releases the GIL while hashing so reads and digests overlap; the
+    process pool is for backends that hold the GIL. cache and memo lookups stay in the calling thread.
+    with an IOScheduler, tasks are fed to the pool per st_dev, never more than the device limit at once.
+    """
+    def __init__(self,
+                 stages=DEFAULT_STAGES,
+                 buffer_size=DEFAULT_BUFFER_SIZE,
+                 cache=None,
+                 memo=None,
+                 workers=DEFAULT_WORKERS,
+                 use_processes=False,
+                 scheduler=None):
+        super(ParallelHasher, self).__init__(stages, buffer_size, cache, memo)
+        self.workers = max(workers, 1)
+        self.use_processes = use_processes
+        self.scheduler = scheduler
+        self.executor = None
+        self._local = threading.local()
+        self._engines = []
+        self._process_bytes_read = 0
+
+    @property
+    def bytes_read(self):
+        return self.engine.bytes_read + self._process_bytes_read + sum(engine.bytes_read for engine in self._engines)
+
+    def thread_engine(self):
+        engine = getattr(self._local, 'engine', None)
+        if engine is None:
+            engine = self._local.engine = HashEngine(self.buffer_size)
+            self._engines.append(engine)
+        return engine
+
+    def stage_digest(self, stage, file_path, file_size):
+        return stage_digest(self.thread_engine(), stage, file_path, file_size)
+
+    def timed_stage_digest(self, stage, file_path, file_size):
+        return _timed_stage_digest(self.thread_engine(), stage, file_path, file_size)
+
+    def submit(self, stage, file_path, file_size):
+        if self.executor is None:
+            if self.use_processes:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='hasher')
+        if self.use_processes:
+            return self.executor.submit(_process_stage_digest, stage, file_path, file_size, self.buffer_size)
+        return self.executor.submit(self.timed_stage_digest, stage, file_path, file_size)
+
+    def digest_files(self, stage, items, keys):
+        self.begin_progress(stage, items)
+        digests = [None] * len(items)
+        misses = []
+        hit_bytes = 0
+        for i, (file_path, file_size) in enumerate(items):
+            digest = self.lookup(stage, file_path, keys.get(file_path))
+            if digest is None:
+                misses.append((i, file_path, file_size))
+            else:
+                digests[i] = digest
+                hit_bytes += stage.read_size(file_size)
+        if self.progress is not None and len(misses) < len(items):
+            # cached digests count as done, at the bytes the stage would have read
+            self.progress.advance(len(items) - len(misses), hit_bytes)
+
+        if self.scheduler is None:
+            queues = {UNKNOWN_DEVICE: deque(misses)}
+            limits = {UNKNOWN_DEVICE: self.workers * 4}
+        else:
+            queues = self.scheduler.plan(misses, keys)
+            limits = {dev: self.scheduler.limit(dev) for dev in queues}
+
+        # keep at most limits[dev] reads in flight per device, refill a device when one of its reads ends
+        in_flight = {}
+        running = dict.fromkeys(queues, 0)
+
+        def refill(dev):
+            queue = queues[dev]
+            while queue and running[dev] < limits[dev]:
+                i, file_path, file_size = queue.popleft()
+                in_flight[self.submit(stage, file_path, file_size)] = (dev, i)
+                running[dev] += 1
+
+        for dev in queues:
+            refill(dev)
+
+        while in_flight:
+            if self.cancel_token is not None and self.cancel_token.cancelled:
+                # reads already running end on their own, the queued ones never start
+                for future in in_flight:
+                    future.cancel()
+                self.cancel_token.check()
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                dev, i = in_flight.pop(future)
+                running[dev] -= 1
+                refill(dev)
+
+                file_path = items[i][0]
+                try:
+                    digest, bytes_read, start, end = future.result()
+                except OSError as ex:
+                    logger.info(ex)
+                    if self.progress is not None:
+                        self.progress.advance(1, 0)
+                    continue
+                if self.progress is not None:
+                    self.progress.advance(1, bytes_read)
+                if self.use_processes:
+                    self._process_bytes_read += bytes_read
+                if self.scheduler is not None:
+                    self.scheduler.record(dev, bytes_read, start, end)
+                self.store(stage, file_path, keys.get(file_path), digest)
+                digests[i] = digest
+        return digests
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,217 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from loguru import logger
+
+from .plan import DuplicateFiles
+
+PERCEPTUAL_HASHES = ['ahash', 'dhash', 'phash']
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp'}
+HASH_BITS = 64
+# pHash keeps the lowest 8x8 DCT frequencies of a 32x32 thumbnail
+PHASH_SIZE = 32
+DEFAULT_DISTANCE = 6
+
+
+def is_image(file_path):
+    return os.path.splitext(file_path)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos(np.pi * (2 * x + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def thumbnail(file_path, width, height):
+    """grayscale float array of the decoded image scaled to width x height, needs Pillow"""
+    from PIL import Image
+
+    with Image.open(file_path) as image:
+        # JPEG can decode at 1/2 .. 1/8 scale directly, far cheaper than a full decode
+        image.draft('L', (width * 4, height * 4))
+        image = image.convert('L').resize((width, height), Image.Resampling.BILINEAR)
+        return np.asarray(image, dtype=np.float32)
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def ahash(file_path):
+    pixels = thumbnail(file_path, 8, 8)
+    return _bits_to_int(pixels > pixels.mean())
+
+
+def dhash(file_path):
+    pixels = thumbnail(file_path, 9, 8)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(file_path):
+    pixels = thumbnail(file_path, PHASH_SIZE, PHASH_SIZE)
+    low = (_DCT @ pixels @ _DCT.T)[:8, :8].ravel()
+    # the DC term only says how bright the image is
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+HASH_FUNCTIONS = {'ahash': ahash, 'dhash': dhash, 'phash': phash}
+
+
+def image_hash(kind, file_path):
+    """runs on the process pool, None for files that cannot be decoded"""
+    try:
+        return HASH_FUNCTIONS[kind](file_path)
+    except Exception:
+        return None
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree():
+    """Burkhard-Keller tree over Hamming distance: a query with a small radius visits only the subtrees
+    whose edge distance lies within radius of the query's distance to the node"""
+    def __init__(self):
+        self.root = None
+        self.count = 0
+
+    def add(self, value, item):
+        self.count += 1
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def query(self, value, radius):
+        """[(distance, item)] of every item within radius"""
+        found = []
+        if self.root is None:
+            return found
+        pending = [self.root]
+        while pending:
+            node_value, items, children = pending.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    pending.append(child)
+        return found
+
+    def __len__(self):
+        return self.count
+
+
+class PerceptualHasher():
+    """perceptual hashes of image files on a process pool, stored in the hash cache beside the digests"""
+    def __init__(self, kind='phash', workers=None, cache=None, progress=None, cancel_token=None):
+        if kind not in HASH_FUNCTIONS:
+            raise ValueError(f'unknown perceptual hash: {kind}, available: {", ".join(PERCEPTUAL_HASHES)}')
+        self.kind = kind
+        self.workers = workers
+        self.cache = cache
+        self.progress = progress
+        self.cancel_token = cancel_token
+
+    def hash_records(self, records):
+        """{file_path: int hash} of the records that could be decoded"""
+        hashes = {}
+        misses = []
+        for record in records:
+            key = (record.dev, record.ino, record.size, record.mtime_ns)
+            cached = None if self.cache is None else self.cache.get(key, self.kind, self.kind)
+            if cached is None:
+                misses.append(record)
+            else:
+                hashes[record.path] = int(cached, 16)
+
+        if self.progress is not None:
+            total_bytes = sum(record.size for record in records)
+            self.progress.begin(self.kind, len(records), total_bytes)
+            self.progress.advance(len(records) - len(misses), total_bytes - sum(record.size for record in misses))
+
+        if misses:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                values = executor.map(image_hash, [self.kind] * len(misses), [r.path for r in misses], chunksize=16)
+                for record, value in zip(misses, values):
+                    if self.cancel_token is not None and self.cancel_token.cancelled:
+                        # the chunks not started yet are dropped, the worker processes exit with the pool
+                        executor.shutdown(wait=True, cancel_futures=True)
+                        self.cancel_token.check()
+                    if self.progress is not None:
+                        self.progress.advance(1, record.size)
+                    if value is None:
+                        logger.info(f'cannot decode image: {record.path}')
+                        continue
+                    hashes[record.path] = value
+                    if self.cache is not None:
+                        key = (record.dev, record.ino, record.size, record.mtime_ns)
+                        self.cache.put(key, self.kind, self.kind, f'{value:016x}')
+        return hashes
+
+    def similar_groups(self, records, distance=DEFAULT_DISTANCE):
+        """groups of images whose hashes are within distance bits of each other (linked transitively)
+
+        the largest file of a group is kept, a resized or re-encoded copy is usually the smaller one. only
+        the members within distance of the keeper are in its remove list, A~B~C does not make C a copy of A;
+        the others come back as the second value, [records linked to a group but kept]
+        """
+        hashes = self.hash_records(records)
+        by_path = {record.path: record for record in records if record.path in hashes}
+        tree = BKTree()
+        for file_path, value in hashes.items():
+            tree.add(value, file_path)
+
+        parent = {}
+
+        def find(file_path):
+            root = file_path
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while file_path != root:
+                parent[file_path], file_path = root, parent.get(file_path, file_path)
+            return root
+
+        for file_path, value in hashes.items():
+            for _, other in tree.query(value, distance):
+                a, b = find(file_path), find(other)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+
+        groups = {}
+        for file_path in hashes:
+            groups.setdefault(find(file_path), []).append(by_path[file_path])
+
+        result = []
+        loose = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            members.sort(key=lambda record: (-record.size, record.path))
+            keep = members[0]
+            near, far = [], []
+            for record in members[1:]:
+                (near if hamming(hashes[record.path], hashes[keep.path]) <= distance else far).append(record)
+            if far:
+                loose.append(far)
+            if near:
+                result.append(
+                    DuplicateFiles(f'{hashes[keep.path]:016x}', self.kind, keep.size, keep, near, 'largest', kind='similar'))
+        return result, loose
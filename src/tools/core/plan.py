@@ -0,0 +1,126 @@
+from collections import namedtuple
+
+from loguru import logger
+
+from . import actions
+from .verify import compare_files
+
+# rule: which field decided the keeper, 'ctime' / 'mtime' when it is the oldest by that date, 'path' on a tie,
+# 'reference' when the keeper is a reference copy
+# kind: 'exact' or 'similar' (near-duplicate images), report_only: remove is what would be removed, the
+# group is never acted on
+DuplicateFiles = namedtuple('DuplicateFiles',
+                            ['digest', 'algorithm', 'file_size', 'keep', 'remove', 'rule', 'kind', 'report_only'],
+                            defaults=('ctime', 'exact', False))
+
+KEEPER_ORDER = ('ctime', 'mtime', 'path')
+
+
+def choose_keeper(records, protected=None):
+    """oldest by create date, then modify date, then path; returns (keep, remove, rule)
+
+    files in protected (reference copies) are never removed and one of them is always the keeper, None
+    when there is nothing to remove
+    """
+    records = sorted(records, key=lambda record: (record.ctime, record.mtime, record.path))
+    if protected:
+        references = [record for record in records if record.path in protected]
+        if references:
+            remove = [record for record in records if record.path not in protected]
+            return (references[0], remove, 'reference') if remove else None
+    keep = records[0]
+    runner_up = records[1]
+    for rule in KEEPER_ORDER:
+        if getattr(keep, rule) != getattr(runner_up, rule):
+            return keep, records[1:], rule
+    return keep, records[1:], 'path'
+
+
+class DedupPlan():
+    """keep / remove decisions for every duplicate group, resolved once before anything is touched
+
+    groups that failed byte verification are kept whole and listed in `unverified`. execute() runs the
+    plan once: every group is reported to on_group, and unless dry_run its removals are submitted to the
+    executor (or trashed in place without one).
+    """
+    def __init__(self, algorithm=None):
+        self.algorithm = algorithm
+        self.groups = []
+        self.unverified = []
+        self.executed = False
+
+    def add(self, records, digest, algorithm=None, verify=False, protected=None):
+        """resolve one hash group, returns its DuplicateFiles or None when verification failed or only
+        protected files (or other paths to the keeper) are in it"""
+        if len(records) < 2:
+            return None
+        decision = choose_keeper(records, protected)
+        if decision is None:
+            return None
+        keep, remove, rule = decision
+        # the keeper reached by another path (a symlinked directory, a hardlink): acting on it acts on the keeper
+        if keep.ino and any((record.dev, record.ino) == (keep.dev, keep.ino) for record in remove):
+            records = [keep] + [record for record in remove if (record.dev, record.ino) != (keep.dev, keep.ino)]
+            if len(records) < 2:
+                return None
+            keep, remove, rule = choose_keeper(records, protected)
+        # hash equality is not enough for some jobs, compare the bytes and leave the group alone on any mismatch
+        if verify:
+            try:
+                identical = compare_files([record.path for record in records])
+            except (OSError, ValueError) as ex:
+                # a file removed, unreadable or resized since it was hashed
+                logger.info(ex)
+                identical = []
+            if len(identical) != 1 or len(identical[0]) != len(records):
+                logger.info(f'verification failed, keep all files of {digest}: {[record.path for record in records]}')
+                self.unverified.append(records)
+                return None
+
+        group = DuplicateFiles(digest, algorithm or self.algorithm, keep.size, keep, remove, rule)
+        self.groups.append(group)
+        return group
+
+    @property
+    def remove_count(self):
+        return sum(len(group.remove) for group in self.groups)
+
+    @property
+    def bytes_reclaimable(self):
+        # upper bound, a duplicate that is a hardlink of another file frees nothing
+        return sum(record.size for group in self.groups for record in group.remove)
+
+    def summary(self):
+        return {
+            'groups': len(self.groups),
+            'remove': self.remove_count,
+            'bytes_reclaimable': self.bytes_reclaimable,
+            'unverified': len(self.unverified),
+        }
+
+    def execute(self, dry_run=False, executor=None, on_group=None, cancel_token=None):
+        """report (and unless dry_run act on) every group, returns how many files were removed
+
+        a cancelled token stops it between two groups, the groups already handed on are not taken back
+        """
+        if self.executed:
+            raise RuntimeError('the plan was already executed')
+        self.executed = True
+
+        for group in self.groups:
+            if cancel_token is not None:
+                cancel_token.check()
+            # on_group sees every group, also in dry-run
+            if on_group is not None:
+                on_group(group)
+            if dry_run:
+                continue
+            for record in group.remove:
+                if executor is not None:
+                    executor.submit(record, group.keep)
+                    continue
+                try:
+                    actions.move_to_trash(record.path)
+                except Exception as ex:
+                    logger.info(ex)
+        return self.remove_count
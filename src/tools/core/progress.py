@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import namedtuple
+
+# files / bytes are counted since the stage began, the totals and eta are None while the stage size is unknown
+StageProgress = namedtuple('StageProgress', [
+    'stage', 'files', 'bytes', 'total_files', 'total_bytes', 'elapsed', 'files_per_s', 'bytes_per_s', 'eta', 'done'
+])
+
+DEFAULT_INTERVAL = 0.25
+# records a walk yields between two cancellation checks
+CHECK_EVERY = 256
+
+
+class Cancelled(Exception):
+    """raised at the next check point once the CancelToken is cancelled"""
+
+
+class CancelToken():
+    """cooperative cancellation: the worker checks it between files and groups, nothing is interrupted midway"""
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+
+class ProgressReporter():
+    """per-stage counters with files/s, bytes/s and ETA, reported at most once per interval
+
+    duplicate groups are collected and handed over in batches with the next report. the callbacks run on
+    the worker thread: on_progress(StageProgress), on_groups([DuplicateFiles]) and on_finish(error), a GUI
+    forwards them through queued signals. advance() is meant to be called from one thread only.
+    """
+    def __init__(self, on_progress=None, on_groups=None, on_finish=None, interval=DEFAULT_INTERVAL, clock=time.monotonic):
+        self.on_progress = on_progress
+        self.on_groups = on_groups
+        self.on_finish = on_finish
+        self.interval = interval
+        self.clock = clock
+        self.stage = None
+        self.files = 0
+        self.bytes = 0
+        self.total_files = None
+        self.total_bytes = None
+        self.started = None
+        self.reported = None
+        self.pending_groups = []
+
+    def begin(self, stage, total_files=None, total_bytes=None):
+        """start a new stage, the previous one is reported as done"""
+        self.end()
+        self.stage = stage
+        self.files = 0
+        self.bytes = 0
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.started = self.reported = self.clock()
+
+    def advance(self, files=1, nbytes=0):
+        self.files += files
+        self.bytes += nbytes
+        if self.clock() - self.reported >= self.interval:
+            self.report()
+
+    def add_group(self, group):
+        self.pending_groups.append(group)
+        if self.reported is None or self.clock() - self.reported >= self.interval:
+            self.report()
+
+    def snapshot(self, done=False):
+        elapsed = max(self.clock() - self.started, 1e-9)
+        files_per_s = self.files / elapsed
+        bytes_per_s = self.bytes / elapsed
+        eta = None
+        if not done:
+            # bytes are the better measure of the work left when the stage knows them
+            if self.total_bytes and bytes_per_s > 0:
+                eta = max(self.total_bytes - self.bytes, 0) / bytes_per_s
+            elif self.total_files and files_per_s > 0:
+                eta = max(self.total_files - self.files, 0) / files_per_s
+        return StageProgress(self.stage, self.files, self.bytes, self.total_files, self.total_bytes, elapsed, files_per_s,
+                             bytes_per_s, 0.0 if done else eta, done)
+
+    def report(self, done=False):
+        self.reported = self.clock()
+        if self.stage is not None and self.on_progress is not None:
+            self.on_progress(self.snapshot(done))
+        if self.pending_groups:
+            groups, self.pending_groups = self.pending_groups, []
+            if self.on_groups is not None:
+                self.on_groups(groups)
+
+    def end(self):
+        if self.stage is not None:
+            self.report(done=True)
+            self.stage = None
+
+    def finish(self, error=None):
+        self.end()
+        self.report()
+        if self.on_finish is not None:
+            self.on_finish(error)
+
+
+def track(records, progress=None, cancel_token=None, stage='walk'):
+    """pass the records of a walk through, counted for the progress report and checked for cancellation"""
+    if progress is not None:
+        progress.begin(stage)
+    count = 0
+    for record in records:
+        count += 1
+        if cancel_token is not None and count % CHECK_EVERY == 0:
+            cancel_token.check()
+        if progress is not None:
+            progress.advance(1, record.size)
+        yield record
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+
+from loguru import logger
+
+from .walker import FileRecord, Walker
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    head TEXT,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+'''
+
+# rows fetched / hashed per round trip
+BATCH_SIZE = 1000
+
+
+class ReferenceIndex():
+    """precomputed hash index of a read-only reference library (SQLite)
+
+    one row per file: size, mtime_ns, the digest of the first (head) stage and the full-file digest of
+    the last stage. the stage keys and algorithms are stored in meta, an index built with other stages
+    can still be matched on full digests as long as the final algorithm is the same.
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(_SCHEMA)
+        self.meta = dict(self.conn.execute('SELECT name, value FROM meta'))
+
+    @property
+    def algorithm(self):
+        return self.meta.get('algorithm')
+
+    def head_matches(self, stage):
+        # head digests are only comparable when the current first stage hashes the same bytes the same way
+        return self.meta.get('head_stage') == stage.key and self.meta.get('head_algorithm') == stage.algorithm
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def build(self, roots, hasher, walker=None):
+        """index (or refresh) every file under roots, files whose size and mtime_ns did not change are kept"""
+        walker = Walker() if walker is None else walker
+        head_stage = hasher.stages[0]
+        final_stage = hasher.stages[-1]
+        meta = {
+            'algorithm': final_stage.algorithm,
+            'head_stage': head_stage.key,
+            'head_algorithm': head_stage.algorithm,
+        }
+        if self.algorithm is not None and self.algorithm != meta['algorithm']:
+            raise ValueError(f'index {self.db_path} holds {self.algorithm} digests, the hasher produces {meta["algorithm"]}')
+
+        roots = [os.path.abspath(root) for root in roots]
+        seen = set()
+        indexed = 0
+
+        def flush(records):
+            nonlocal indexed
+            stored = {}
+            for i in range(0, len(records), 500):
+                chunk = [record.path for record in records[i:i + 500]]
+                stored.update((row[0], row[1:]) for row in self.conn.execute(
+                    f'SELECT path, size, mtime_ns, head FROM files WHERE path IN ({",".join("?" * len(chunk))})', chunk))
+            head_valid = self.head_matches(head_stage)
+
+            def stale(record):
+                row = stored.get(record.path)
+                return row is None or row[:2] != (record.size, record.mtime_ns) or row[2] is None or not head_valid
+
+            changed = [record for record in records if stale(record)]
+            if not changed:
+                return
+            keys = {r.path: (r.dev, r.ino, r.size, r.mtime_ns) for r in changed}
+            items = [(r.path, r.size) for r in changed]
+            heads = hasher.digest_files(head_stage, items, keys)
+            digests = hasher.digest_files(final_stage, items, keys)
+            rows = [(r.path, r.size, r.mtime_ns, head, digest) for r, head, digest in zip(changed, heads, digests)
+                    if digest is not None]
+            with self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', rows)
+            indexed += len(rows)
+
+        pending = []
+        for record in walker.walk(*roots):
+            seen.add(record.path)
+            pending.append(record)
+            if len(pending) >= BATCH_SIZE:
+                flush(pending)
+                pending = []
+        flush(pending)
+
+        # files that disappeared from the roots
+        removed = []
+        for (file_path, ) in self.conn.execute('SELECT path FROM files'):
+            if file_path not in seen and any(file_path.startswith(os.path.join(root, '')) for root in roots):
+                removed.append((file_path, ))
+        with self.conn:
+            self.conn.executemany('DELETE FROM files WHERE path=?', removed)
+            self.conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', meta.items())
+        self.meta.update(meta)
+        logger.info(f'Reference Index: {indexed} files hashed, {len(removed)} removed, {len(self)} total')
+        return indexed
+
+    def lookup(self, sizes):
+        """{size: [(FileRecord, head, digest)]} of the indexed files with one of the given sizes"""
+        result = {}
+        sizes = list(sizes)
+        for i in range(0, len(sizes), 500):
+            chunk = sizes[i:i + 500]
+            rows = self.conn.execute(
+                f'SELECT path, size, mtime_ns, head, digest FROM files WHERE size IN ({",".join("?" * len(chunk))})',
+                chunk)
+            for file_path, file_size, mtime_ns, head, digest in rows:
+                # the library is not stat'ed, only what the index knows goes into the record
+                record = FileRecord(file_path, file_size, 0, 0, mtime_ns / 1e9, mtime_ns / 1e9, mtime_ns)
+                result.setdefault(file_size, []).append((record, head, digest))
+        return result
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,216 @@
+import os
+import sqlite3
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from .walker import FileRecord, Walker
+
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.expanduser('~'), '.duplicate_file_removal', 'snapshot.db')
+
+# a directory changed this close to the moment it was recorded may change again within the same mtime tick
+RACY_SECONDS = 2
+
+Delta = namedtuple('Delta', ['new', 'changed', 'deleted', 'listed_dirs', 'skipped_dirs'])
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL,
+    entries INTEGER NOT NULL,
+    scanned_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    ino INTEGER NOT NULL,
+    dev INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    ctime REAL NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+CREATE INDEX IF NOT EXISTS files_size ON files (size);
+'''
+
+
+def merge_deltas(deltas):
+    # one Delta for several roots
+    return Delta([record for delta in deltas for record in delta.new], [record for delta in deltas for record in delta.changed],
+                 [record for delta in deltas for record in delta.deleted], sum(delta.listed_dirs for delta in deltas),
+                 sum(delta.skipped_dirs for delta in deltas))
+
+
+def _record(row):
+    return FileRecord(*row)
+
+
+class TreeSnapshot():
+    """persisted directory tree (mtime_ns and entry count per directory) and file index, SQLite in WAL mode
+
+    a rescan lists only directories whose mtime changed (or that were recorded within RACY_SECONDS of
+    their last change); unchanged directories are stat'ed once to be descended through their stored
+    children. a file rewritten in place does not touch its directory's mtime, run with full=True (or
+    with the hash cache, which keys on the file's own mtime) when that matters.
+    """
+    def __init__(self, db_path=DEFAULT_SNAPSHOT_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(_SCHEMA)
+
+    def _dir_row(self, dir_path):
+        return self.conn.execute('SELECT mtime_ns, scanned_at FROM dirs WHERE path=?', (dir_path, )).fetchone()
+
+    def _children(self, dir_path):
+        return [row[0] for row in self.conn.execute('SELECT path FROM dirs WHERE parent=?', (dir_path, ))]
+
+    def _dir_files(self, dir_path):
+        return {
+            row[0]: _record(row)
+            for row in self.conn.execute(
+                'SELECT path, size, ino, dev, mtime, ctime, mtime_ns FROM files WHERE dir=?', (dir_path, ))
+        }
+
+    def _forget_tree(self, dir_path):
+        # a directory vanished: everything recorded below it is deleted
+        deleted = []
+        pending = [dir_path]
+        while pending:
+            path = pending.pop()
+            pending.extend(self._children(path))
+            deleted.extend(self._dir_files(path).values())
+            self.conn.execute('DELETE FROM files WHERE dir=?', (path, ))
+            self.conn.execute('DELETE FROM dirs WHERE path=?', (path, ))
+        return deleted
+
+    def _visit(self, walker, dir_path, stored, full):
+        """runs on the pool: stat the directory, list it only if it changed"""
+        try:
+            st = os.stat(dir_path)
+        except OSError:
+            return None, None
+        if not full and stored is not None:
+            mtime_ns, scanned_at = stored
+            if st.st_mtime_ns == mtime_ns and st.st_mtime_ns / 1e9 < scanned_at - RACY_SECONDS:
+                return st, None
+        return st, walker.list_dir(dir_path)
+
+    @contextmanager
+    def _transaction(self, commit):
+        try:
+            yield
+        except BaseException:
+            self.conn.rollback()
+            raise
+        if commit:
+            self.conn.commit()
+
+    def scan(self, root, walker=None, full=False, commit=True):
+        """walk root against the snapshot, update it and return the Delta
+
+        with commit=False the update is left in the open transaction, same_size() already sees it. commit()
+        records it once the delta was acted on, closing without a commit drops it and the next scan returns
+        the same delta again.
+        """
+        walker = Walker() if walker is None else walker
+        root = os.path.abspath(root)
+        new, changed, deleted = [], [], []
+        listed_dirs = skipped_dirs = 0
+        # (dev, ino) of the directories entered, as in Walker.listings: with follow_symlinks a loop ends here
+        visited = set()
+
+        pending = deque([(root, None)])
+        max_in_flight = walker.workers * 4
+        transaction = self._transaction(commit)
+        with ThreadPoolExecutor(max_workers=walker.workers, thread_name_prefix='snapshot') as executor, transaction:
+            in_flight = {}
+            while pending or in_flight:
+                while pending and len(in_flight) < max_in_flight:
+                    dir_path, parent = pending.popleft()
+                    future = executor.submit(self._visit, walker, dir_path, self._dir_row(dir_path), full)
+                    in_flight[future] = (dir_path, parent)
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_path, parent = in_flight.pop(future)
+                    st, listing = future.result()
+
+                    if st is None:
+                        deleted.extend(self._forget_tree(dir_path))
+                        continue
+                    if walker.follow_symlinks:
+                        if (st.st_dev, st.st_ino) in visited:
+                            # a second path to a directory already entered: not descended, and dropped from the
+                            # snapshot if an older scan recorded it (its files are the same files)
+                            self._forget_tree(dir_path)
+                            continue
+                        visited.add((st.st_dev, st.st_ino))
+
+                    if listing is None:
+                        skipped_dirs += 1
+                        pending.extend((child, dir_path) for child in self._children(dir_path))
+                        continue
+
+                    listed_dirs += 1
+                    records, sub_dirs = listing
+                    stored_files = self._dir_files(dir_path)
+                    for record in records:
+                        old = stored_files.pop(record.path, None)
+                        if old is None:
+                            new.append(record)
+                        elif old.size != record.size or old.mtime_ns != record.mtime_ns or old.ino != record.ino:
+                            changed.append(record)
+                    deleted.extend(stored_files.values())
+
+                    self.conn.executemany('DELETE FROM files WHERE path=?', [(path, ) for path in stored_files])
+                    self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                          [(r.path, dir_path, r.size, r.ino, r.dev, r.mtime, r.ctime, r.mtime_ns)
+                                           for r in records])
+
+                    sub_dir_set = set(sub_dirs)
+                    for child in self._children(dir_path):
+                        if child not in sub_dir_set:
+                            deleted.extend(self._forget_tree(child))
+                    self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)',
+                                      (dir_path, parent, st.st_mtime_ns, len(records) + len(sub_dirs), time.time()))
+                    pending.extend((child, dir_path) for child in sub_dirs)
+
+        return Delta(new, changed, deleted, listed_dirs, skipped_dirs)
+
+    def same_size(self, sizes, roots):
+        """stored records under roots whose size is in sizes, {size: [FileRecord]}
+
+        one snapshot database holds every tree ever scanned into it, files of other trees are never returned
+        """
+        prefixes = [os.path.join(os.path.abspath(root), '') for root in roots]
+        under_roots = ' OR '.join('substr(path, 1, ?) = ?' for _ in prefixes)
+        prefix_args = [arg for prefix in prefixes for arg in (len(prefix), prefix)]
+        buckets = {}
+        sizes = list(sizes)
+        for i in range(0, len(sizes), 500):
+            chunk = sizes[i:i + 500]
+            rows = self.conn.execute(
+                f'SELECT path, size, ino, dev, mtime, ctime, mtime_ns FROM files '
+                f'WHERE size IN ({",".join("?" * len(chunk))}) AND ({under_roots})', chunk + prefix_args)
+            for row in rows:
+                buckets.setdefault(row[1], []).append(_record(row))
+        return buckets
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
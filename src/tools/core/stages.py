@@ -0,0 +1,228 @@
+import os
+
+from loguru import logger
+
+from .hash_cache import cache_key
+from .hashers import FAST_HASHER, STRONG_HASHER, get_hasher
+from .hashing import DEFAULT_BUFFER_SIZE, HashEngine
+from .metrics import measure
+
+
+class HashStage():
+    """one filter stage: hash head (+ middle samples) (+ tail) blocks, block_size 0 hashes the whole file"""
+    def __init__(self, name, block_size=0, tail=False, middle=0, algorithm=None):
+        self.name = name
+        self.block_size = block_size
+        self.tail = tail
+        self.middle = middle
+        if algorithm is None:
+            algorithm = STRONG_HASHER if block_size <= 0 else FAST_HASHER
+        get_hasher(algorithm)
+        self.algorithm = algorithm
+
+    def ranges(self, file_size):
+        # None means the stage reads the whole file
+        block_size = self.block_size
+        if block_size <= 0 or block_size * (1 + int(self.tail) + self.middle) >= file_size:
+            return None
+
+        ranges = [(0, block_size)]
+        for i in range(1, self.middle + 1):
+            offset = file_size * i // (self.middle + 1) - block_size // 2
+            ranges.append((offset, block_size))
+        if self.tail:
+            ranges.append((file_size - block_size, block_size))
+        return ranges
+
+    @property
+    def key(self):
+        # identifies what was hashed, so cached digests survive renaming a stage
+        return f'{self.block_size}:{int(self.tail)}:{self.middle}'
+
+    def covers(self, file_size):
+        return self.ranges(file_size) is None
+
+    def read_size(self, file_size):
+        ranges = self.ranges(file_size)
+        return file_size if ranges is None else sum(length for _, length in ranges)
+
+    def __repr__(self):
+        return (f'HashStage({self.name!r}, block_size={self.block_size}, tail={self.tail}, middle={self.middle}, '
+                f'algorithm={self.algorithm!r})')
+
+
+DEFAULT_STAGES = (
+    HashStage('head', 4 * 1024),
+    HashStage('head_tail', 64 * 1024, tail=True),
+    HashStage('full'),
+)
+
+
+def stage_digest(engine, stage, file_path, file_size):
+    hash_obj = get_hasher(stage.algorithm)
+    with open(file_path, 'rb', buffering=0) as f:
+        ranges = stage.ranges(file_size)
+        if ranges is None:
+            engine.update_from(hash_obj, f)
+        else:
+            for offset, length in ranges:
+                f.seek(offset)
+                engine.update_from(hash_obj, f, length)
+    return hash_obj.hexdigest()
+
+
+class StagedHasher():
+    """narrow same-size candidate lists stage by stage, only files that still collide reach the next stage"""
+    def __init__(self, stages=DEFAULT_STAGES, buffer_size=DEFAULT_BUFFER_SIZE, cache=None, memo=None):
+        if len(stages) == 0 or stages[-1].block_size > 0:
+            raise ValueError('the last stage must hash the whole file')
+        self.stages = list(stages)
+        self.buffer_size = buffer_size
+        self.engine = HashEngine(buffer_size)
+        self.cache = cache
+        # optional in-memory {(file_path, stage key, algorithm): digest}, for callers that re-check the same bucket
+        self.memo = memo
+        # optional ProgressReporter / CancelToken, checked once per file, and MetricsRecorder for every stage
+        self.progress = None
+        self.cancel_token = None
+        self.metrics = None
+
+    @property
+    def algorithm(self):
+        # every reported digest comes from the last (confirming) stage
+        return self.stages[-1].algorithm
+
+    @property
+    def bytes_read(self):
+        return self.engine.bytes_read
+
+    def stage_digest(self, stage, file_path, file_size):
+        return stage_digest(self.engine, stage, file_path, file_size)
+
+    def lookup(self, stage, file_path, key):
+        if self.memo is not None:
+            digest = self.memo.get((file_path, stage.key, stage.algorithm))
+            if digest is not None:
+                return digest
+        if key is not None and self.cache is not None:
+            digest = self.cache.get(key, stage.key, stage.algorithm)
+            if digest is not None and self.memo is not None:
+                self.memo[(file_path, stage.key, stage.algorithm)] = digest
+            return digest
+        return None
+
+    def store(self, stage, file_path, key, digest):
+        if self.memo is not None:
+            self.memo[(file_path, stage.key, stage.algorithm)] = digest
+        if key is not None and self.cache is not None:
+            self.cache.put(key, stage.key, stage.algorithm, digest)
+
+    def forget(self, file_path):
+        if self.memo is not None:
+            for stage in self.stages:
+                self.memo.pop((file_path, stage.key, stage.algorithm), None)
+
+    def digest_files(self, stage, items, keys):
+        """items is a list of (file_path, file_size), returns one digest per item, None if it cannot be read"""
+        self.begin_progress(stage, items)
+        digests = []
+        for file_path, file_size in items:
+            if self.cancel_token is not None:
+                self.cancel_token.check()
+            if self.progress is not None:
+                self.progress.advance(1, stage.read_size(file_size))
+            key = keys.get(file_path)
+            digest = self.lookup(stage, file_path, key)
+            if digest is None:
+                try:
+                    digest = self.stage_digest(stage, file_path, file_size)
+                except OSError as ex:
+                    logger.info(ex)
+                    digests.append(None)
+                    continue
+                self.store(stage, file_path, key, digest)
+            digests.append(digest)
+        return digests
+
+    def begin_progress(self, stage, items):
+        if self.progress is not None:
+            self.progress.begin(f'hash {stage.name}', len(items),
+                                sum(stage.read_size(file_size) for _, file_size in items))
+
+    def cache_keys(self, file_paths, keys=None):
+        if keys is not None:
+            return keys
+        if self.cache is None:
+            return {}
+        keys = {}
+        for file_path in file_paths:
+            try:
+                keys[file_path] = cache_key(os.stat(file_path))
+            except OSError as ex:
+                logger.info(ex)
+        return keys
+
+    def find_duplicates(self, file_paths, file_size, keys=None):
+        """return {file_path: digest} for every file that collides with another one after the last stage
+
+        keys maps file_path -> (dev, ino, size, mtime_ns) when the caller already has the stat result
+        """
+        return self.refine({file_size: list(file_paths)}, keys)
+
+    def runs(self, stage, file_size):
+        """whether stage hashes files of file_size: a cheap stage that would read every byte is skipped, the
+        confirming stage reads the file once instead of twice"""
+        return stage is self.stages[-1] or not stage.covers(file_size)
+
+    def stages_for(self, file_size):
+        return [stage for stage in self.stages if self.runs(stage, file_size)]
+
+    def refine(self, buckets, keys=None):
+        """same as find_duplicates for many {file_size: [file_path]} buckets at once, each stage runs over
+        every surviving file of every bucket in one digest_files call"""
+        keys = self.cache_keys([file_path for file_paths in buckets.values() for file_path in file_paths], keys)
+        digests = {}
+        result = {}
+        # file_size -> list of groups still colliding
+        groups = {file_size: [list(file_paths)] for file_size, file_paths in buckets.items() if len(file_paths) > 1}
+
+        for stage in self.stages:
+            items = []
+            for file_size, size_groups in groups.items():
+                if self.runs(stage, file_size):
+                    items.extend((file_path, file_size) for group in size_groups for file_path in group)
+            with measure(self.metrics, f'hash_{stage.name}') as stage_metrics:
+                stage_digests = dict(zip((file_path for file_path, _ in items), self.digest_files(stage, items, keys)))
+                stage_metrics.files += len(items)
+            survivors = 0
+
+            for file_size in list(groups):
+                if not self.runs(stage, file_size):
+                    continue
+                next_groups = []
+                for group in groups[file_size]:
+                    split = {}
+                    for file_path in group:
+                        digest = stage_digests[file_path]
+                        if digest is not None:
+                            split.setdefault(digest, []).append(file_path)
+                    for digest, bucket in split.items():
+                        if len(bucket) > 1:
+                            survivors += len(bucket)
+                            next_groups.append(bucket)
+                            for file_path in bucket:
+                                digests[file_path] = digest
+
+                if len(next_groups) == 0:
+                    del groups[file_size]
+                    continue
+                groups[file_size] = next_groups
+
+            stage_metrics.add_candidates(len(items), survivors)
+            if len(groups) == 0:
+                break
+
+        for size_groups in groups.values():
+            for group in size_groups:
+                result.update((file_path, digests[file_path]) for file_path in group)
+        return result
@@ -0,0 +1,126 @@
+from collections import namedtuple
+
+from .metrics import measure
+from .stages import StagedHasher
+
+DuplicateGroup = namedtuple('DuplicateGroup', ['size', 'digest', 'algorithm', 'records', 'new_records'])
+
+
+class _Node():
+    # records sharing the digests of the stages above: one record waits unhashed in `single` until a second
+    # arrives, then both go one stage down into `children` (digest -> _Node, or digest -> {path: record}
+    # below the last stage)
+    __slots__ = ('single', 'children')
+
+    def __init__(self, single=None):
+        self.single = single
+        self.children = {}
+
+
+class StreamingDeduplicator():
+    """consume walker records one by one and emit duplicate groups as soon as they are confirmed
+
+    every size has a tree of stage digests: a record is hashed one stage deeper only when another record
+    shares all its digests so far, so a new record costs one digest per stage it shares, never a pass
+    over its whole size bucket. a group is emitted when it forms and again, with `new_records`, whenever
+    it grows.
+    """
+    def __init__(self, hasher=None):
+        self.hasher = StagedHasher() if hasher is None else hasher
+        self.roots = {}
+        # path -> the _Node whose single it is, or the group dict it is in
+        self.locations = {}
+        # size -> records of that size, path -> size
+        self.counts = {}
+        self.sizes = {}
+        self.emitted = {}
+
+    @property
+    def candidate_count(self):
+        return sum(count for count in self.counts.values() if count > 1)
+
+    def add(self, record):
+        """add one record, return the duplicate groups it created or grew"""
+        size = record.size
+        self.counts[size] = self.counts.get(size, 0) + 1
+        self.sizes[record.path] = size
+        stages = self.hasher.stages_for(size)
+        node = self.roots.get(size)
+        if node is None:
+            self.roots[size] = self.locations[record.path] = _Node(record)
+            return []
+
+        for level, stage in enumerate(stages):
+            if node.single is None and not node.children:
+                node.single = record
+                self.locations[record.path] = node
+                return []
+            if node.single is not None:
+                waiting, node.single = node.single, None
+                self._push(node, stages, level, waiting)
+            digest = self._digest(stage, record)
+            if digest is None:
+                return []
+            if level == len(stages) - 1:
+                return self._join(size, digest, node.children.setdefault(digest, {}), record)
+            child = node.children.get(digest)
+            if child is None:
+                node.children[digest] = self.locations[record.path] = _Node(record)
+                return []
+            node = child
+        return []
+
+    def _push(self, node, stages, level, record):
+        # the record that waited in node moves one stage down, it is alone there
+        digest = self._digest(stages[level], record)
+        if digest is None:
+            del self.locations[record.path]
+            return
+        if level == len(stages) - 1:
+            group = node.children.setdefault(digest, {})
+            group[record.path] = record
+            self.locations[record.path] = group
+        else:
+            node.children[digest] = self.locations[record.path] = _Node(record)
+
+    def _digest(self, stage, record):
+        keys = {record.path: (record.dev, record.ino, record.size, record.mtime_ns)}
+        with measure(self.hasher.metrics, f'hash_{stage.name}') as stage_metrics:
+            stage_metrics.files += 1
+            return self.hasher.digest_files(stage, [(record.path, record.size)], keys)[0]
+
+    def _join(self, size, digest, group, record):
+        group[record.path] = record
+        self.locations[record.path] = group
+        if len(group) < 2:
+            return []
+        known = self.emitted.setdefault(size, {}).setdefault(digest, set())
+        records = list(group.values())
+        new_records = [r for r in records if r.path not in known]
+        if not new_records:
+            return []
+        known.update(r.path for r in new_records)
+        return [DuplicateGroup(size, digest, self.hasher.algorithm, records, new_records)]
+
+    def discard(self, file_paths):
+        """drop files that were removed (or are no longer wanted) from the digest trees"""
+        for file_path in file_paths:
+            size = self.sizes.pop(file_path, None)
+            if size is None:
+                continue
+            self.counts[size] -= 1
+            location = self.locations.pop(file_path, None)
+            if isinstance(location, _Node):
+                location.single = None
+            elif location is not None:
+                del location[file_path]
+            for known in self.emitted.get(size, {}).values():
+                known.discard(file_path)
+
+    def remove(self, record):
+        """drop a file that was deleted or rewritten"""
+        self.discard([record.path])
+
+    def feed(self, records):
+        for record in records:
+            yield from self.add(record)
@@ -0,0 +1,108 @@
+import mmap
+import os
+from contextlib import ExitStack
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# files mapped at once (a descriptor each), well below the 256 / 1024 descriptor limits of macOS / Linux
+MAX_OPEN_FILES = 128
+
+
+def _words(mm, size):
+    # compare 8 bytes per element, memoryview equality unpacks element by element
+    view = memoryview(mm)
+    words = size // 8 * 8
+    return view[:words].cast('Q'), view[words:size]
+
+
+def _classes(file_paths, block_size):
+    """every class of identical files (singletons too) as lists of positions, all files open at once"""
+    with ExitStack() as stack:
+        sizes = set()
+        views = []
+        for file_path in file_paths:
+            # the mapping keeps a descriptor of its own, the file is closed right away
+            with open(file_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                sizes.add(size)
+                if size == 0:
+                    views.append(None)
+                    continue
+                mm = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            views.append(_words(mm, size))
+            # release the exported buffers before the mmap is closed
+            stack.callback(views[-1][0].release)
+            stack.callback(views[-1][1].release)
+
+        if len(sizes) != 1:
+            raise ValueError(f'files differ in size: {file_paths}')
+        size = sizes.pop()
+        if size == 0:
+            return [list(range(len(file_paths)))]
+
+        classes = [list(range(len(file_paths)))]
+        step = block_size // 8
+        word_count = size // 8
+
+        def split(blocks):
+            nonlocal classes
+            next_classes = []
+            for members in classes:
+                if len(members) == 1:
+                    next_classes.append(members)
+                    continue
+                parts = []
+                for i in members:
+                    block = blocks(i)
+                    for part in parts:
+                        if blocks(part[0]) == block:
+                            part.append(i)
+                            break
+                    else:
+                        parts.append([i])
+                next_classes.extend(parts)
+            classes = next_classes
+
+        for offset in range(0, word_count, step):
+            split(lambda i: views[i][0][offset:offset + step])
+            if len(classes) == len(file_paths):
+                return classes
+        split(lambda i: views[i][1])
+        return classes
+
+
+def compare_files(file_paths, block_size=DEFAULT_BLOCK_SIZE, max_open=MAX_OPEN_FILES):
+    """byte-by-byte comparison of same-size files, the members of a chunk read in lock-step in one pass
+
+    every file is mmap'ed and compared block by block through memoryview slices (no copies); a block
+    splits the current classes, and the pass stops as soon as no class has two members left. at most
+    max_open files are open at once: a larger group goes in rounds, each one compares the first file left
+    with chunks of one file per class still unsettled. raises OSError when a file cannot be opened.
+    returns the classes of identical files that have more than one member.
+    """
+    file_paths = list(file_paths)
+    if len(file_paths) < 2:
+        return []
+    block_size = max(block_size // 8 * 8, 8)
+    chunk_size = max(max_open, 2) - 1
+
+    result = []
+    # classes whose members are known to be identical, not yet compared with each other
+    pending = [[file_path] for file_path in file_paths]
+    while len(pending) > 1:
+        pivot, rest = pending[0], pending[1:]
+        pending = []
+        for i in range(0, len(rest), chunk_size):
+            chunk = [pivot] + rest[i:i + chunk_size]
+            for members in _classes([paths[0] for paths in chunk], block_size):
+                merged = [file_path for j in members for file_path in chunk[j]]
+                if 0 in members:
+                    pivot = merged
+                elif len(rest) <= chunk_size:
+                    # one chunk held every class, they are all settled
+                    result.append(merged)
+                else:
+                    pending.append(merged)
+        result.append(pivot)
+    # a class left alone by the last round has nothing to be compared with
+    result.extend(pending)
+    return [members for members in result if len(members) > 1]
@@ -0,0 +1,139 @@
+import os
+import stat
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from fnmatch import fnmatch
+
+from loguru import logger
+
+FileRecord = namedtuple('FileRecord', ['path', 'size', 'ino', 'dev', 'mtime', 'ctime', 'mtime_ns'])
+
+# stands in for a DirEntry when a single path is checked
+_Entry = namedtuple('_Entry', ['name', 'path'])
+
+
+def _match(patterns, name, path):
+    return any(fnmatch(name, pattern) or fnmatch(path, pattern) for pattern in patterns)
+
+
+class Walker():
+    """iterative directory walker, scandir calls run on a bounded thread pool
+
+    records come straight from DirEntry.stat(), symlinks are skipped unless follow_symlinks is set, in
+    which case every directory is entered once per (dev, ino) so symlink loops terminate.
+    """
+    def __init__(self,
+                 workers=8,
+                 include=None,
+                 exclude=None,
+                 min_size=1,
+                 max_size=None,
+                 follow_symlinks=False,
+                 skip_hidden=True):
+        self.workers = max(workers, 1)
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.min_size = min_size
+        self.max_size = max_size
+        self.follow_symlinks = follow_symlinks
+        self.skip_hidden = skip_hidden
+        # scandir and stat calls so far, for the metrics
+        self.dirs_listed = 0
+        self.stat_calls = 0
+        self._lock = threading.Lock()
+
+    def keep_dir(self, entry):
+        if self.skip_hidden and entry.name[0] in '.$':
+            return False
+        return not _match(self.exclude, entry.name, entry.path)
+
+    def keep_file(self, entry, st):
+        if st.st_size < self.min_size or (self.max_size is not None and st.st_size > self.max_size):
+            return False
+        if self.include and not _match(self.include, entry.name, entry.path):
+            return False
+        return not _match(self.exclude, entry.name, entry.path)
+
+    def stat_file(self, file_path):
+        """FileRecord of one path (a watch event), None if the walker would not have kept it, raises OSError"""
+        st = os.stat(file_path) if self.follow_symlinks else os.lstat(file_path)
+        if not stat.S_ISREG(st.st_mode) or not self.keep_file(_Entry(os.path.basename(file_path), file_path), st):
+            return None
+        return FileRecord(file_path, st.st_size, st.st_ino, st.st_dev, st.st_mtime, st.st_ctime, st.st_mtime_ns)
+
+    def keep_dir_path(self, dir_path):
+        return self.keep_dir(_Entry(os.path.basename(dir_path), dir_path))
+
+    def list_dir(self, dir_path):
+        records = []
+        sub_dirs = []
+        follow = self.follow_symlinks
+        stat_calls = 0
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=follow):
+                            if self.keep_dir(entry):
+                                sub_dirs.append(entry.path)
+                        elif entry.is_file(follow_symlinks=follow):
+                            st = entry.stat(follow_symlinks=follow)
+                            stat_calls += 1
+                            if self.keep_file(entry, st):
+                                records.append(
+                                    FileRecord(entry.path, st.st_size, st.st_ino, st.st_dev, st.st_mtime, st.st_ctime,
+                                               st.st_mtime_ns))
+                    except OSError as ex:
+                        logger.info(ex)
+        except OSError as ex:
+            logger.info(ex)
+        with self._lock:
+            self.dirs_listed += 1
+            self.stat_calls += stat_calls
+        return records, sub_dirs
+
+    def listings(self, *dirs):
+        """(dir_path, records, sub_dirs) of every directory under dirs, as each listing completes
+
+        the sub directories are queued before the tuple is yielded, a caller that tracks the directories
+        still to list (a checkpoint) removes dir_path and adds sub_dirs
+        """
+        visited = set()
+        pending_dirs = deque()
+
+        def enqueue(dir_path):
+            if self.follow_symlinks:
+                try:
+                    st = os.stat(dir_path)
+                except OSError as ex:
+                    logger.info(ex)
+                    return
+                if (st.st_dev, st.st_ino) in visited:
+                    return
+                visited.add((st.st_dev, st.st_ino))
+            pending_dirs.append(dir_path)
+
+        for dir_path in dirs:
+            enqueue(os.fspath(dir_path))
+
+        # keep a few listings queued per worker so the pool never idles, without submitting the whole tree
+        max_in_flight = self.workers * 4
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='walker') as executor:
+            in_flight = {}
+            while pending_dirs or in_flight:
+                while pending_dirs and len(in_flight) < max_in_flight:
+                    dir_path = pending_dirs.popleft()
+                    in_flight[executor.submit(self.list_dir, dir_path)] = dir_path
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dir_path = in_flight.pop(future)
+                    records, sub_dirs = future.result()
+                    for sub_dir in sub_dirs:
+                        enqueue(sub_dir)
+                    yield dir_path, records, sub_dirs
+
+    def walk(self, *roots):
+        for _, records, _ in self.listings(*roots):
+            yield from records
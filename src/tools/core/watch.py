@@ -0,0 +1,244 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from loguru import logger
+
+from .snapshot import TreeSnapshot
+
+# linux/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+_EVENT = struct.Struct('iIII')
+
+# how long an event waits for more events on the same path before it is acted on; a created file that is
+# not closed after writing (os.link, a copy still running) gets longer
+DEFAULT_DEBOUNCE = 0.05
+CREATE_SETTLE = 1.0
+# upper bound of one wait, so a stop request is seen
+WATCH_IDLE = 0.5
+
+
+class Debouncer():
+    """coalesce bursts of events: the last event of a path wins and restarts the path's timer"""
+    def __init__(self, debounce=DEFAULT_DEBOUNCE):
+        self.debounce = debounce
+        self.pending = {}
+
+    def add(self, kind, path):
+        delay = CREATE_SETTLE if kind == 'create' else self.debounce
+        self.pending.pop(path, None)
+        self.pending[path] = (kind, time.monotonic() + delay)
+
+    def timeout(self, idle=WATCH_IDLE):
+        if not self.pending:
+            return idle
+        return min(max(min(due for _, due in self.pending.values()) - time.monotonic(), 0), idle)
+
+    def due(self):
+        now = time.monotonic()
+        ready = [(kind, path) for path, (kind, due) in self.pending.items() if due <= now]
+        for _, path in ready:
+            del self.pending[path]
+        return ready
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class InotifyWatcher():
+    """inotify through ctypes, one watch per directory
+
+    read() turns raw events into ('create' | 'write' | 'delete', file path), ('delete_dir', dir path) and
+    ('rescan', root) after a queue overflow. new directories are watched before they are listed, the
+    files found in them are reported as writes.
+    """
+    def __init__(self, walker, libc=None):
+        self.walker = walker
+        self.libc = _load_libc() if libc is None else libc
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.roots = []
+        self.paths = {}
+        self.wds = {}
+        # (dev, ino) -> path of the directories watched, as in Walker.listings: with follow_symlinks a loop
+        # (or a second path to a watched directory) is not entered again
+        self.visited = {}
+
+    @staticmethod
+    def available():
+        return _load_libc() is not None
+
+    def _add_watch(self, dir_path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            # ENOSPC: fs.inotify.max_user_watches is exhausted
+            logger.info(OSError(ctypes.get_errno(), 'inotify_add_watch failed', dir_path))
+            return
+        self.paths[wd] = dir_path
+        self.wds[dir_path] = wd
+
+    def _remove_tree(self, dir_path):
+        prefix = dir_path + os.sep
+        for path in [path for path in self.wds if path == dir_path or path.startswith(prefix)]:
+            self.libc.inotify_rm_watch(self.fd, self.wds[path])
+            self.paths.pop(self.wds.pop(path), None)
+        for key in [key for key, path in self.visited.items() if path == dir_path or path.startswith(prefix)]:
+            del self.visited[key]
+
+    def add_tree(self, root, is_root=True):
+        """watch root and every directory below it, returns the records of the files found"""
+        root = os.path.abspath(root)
+        if is_root:
+            self.roots.append(root)
+        records = []
+        pending = [root]
+        while pending:
+            dir_path = pending.pop()
+            if self.walker.follow_symlinks:
+                try:
+                    st = os.stat(dir_path)
+                except OSError as ex:
+                    logger.info(ex)
+                    continue
+                if (st.st_dev, st.st_ino) in self.visited:
+                    continue
+                self.visited[(st.st_dev, st.st_ino)] = dir_path
+            # watch first, list after: a file created in between is reported twice, never missed
+            self._add_watch(dir_path)
+            dir_records, sub_dirs = self.walker.list_dir(dir_path)
+            records.extend(dir_records)
+            pending.extend(sub_dirs)
+        return records
+
+    def read(self, timeout):
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except InterruptedError:
+            return []
+        if not ready:
+            return []
+
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + name_len].rstrip(b'\0')
+                offset += _EVENT.size + name_len
+                events.extend(self._translate(wd, mask, os.fsdecode(name)))
+        return events
+
+    def _translate(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            return [('rescan', root) for root in self.roots]
+        dir_path = self.paths.get(wd)
+        if dir_path is None:
+            return []
+        if mask & IN_IGNORED:
+            self.paths.pop(wd, None)
+            self.wds.pop(dir_path, None)
+            return []
+        if mask & IN_DELETE_SELF:
+            return []
+
+        path = os.path.join(dir_path, name)
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if not self.walker.keep_dir_path(path):
+                    return []
+                return [('write', record.path) for record in self.add_tree(path, is_root=False)]
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                self._remove_tree(path)
+                return [('delete_dir', path)]
+            return []
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            return [('write', path)]
+        if mask & IN_CREATE:
+            return [('create', path)]
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            return [('delete', path)]
+        return []
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher():
+    """fallback without inotify: the tree is compared against an in-memory snapshot every interval"""
+    def __init__(self, walker, interval=2.0):
+        self.walker = walker
+        self.interval = interval
+        self.snapshot = TreeSnapshot(':memory:')
+        self.roots = []
+        self.next_poll = time.monotonic() + interval
+
+    @staticmethod
+    def available():
+        return True
+
+    def add_tree(self, root):
+        root = os.path.abspath(root)
+        self.roots.append(root)
+        return self.snapshot.scan(root, self.walker, full=True).new
+
+    def read(self, timeout):
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return []
+        time.sleep(max(wait, 0))
+        self.next_poll = time.monotonic() + self.interval
+
+        events = []
+        for root in self.roots:
+            # full: files rewritten in place do not change their directory's mtime
+            delta = self.snapshot.scan(root, self.walker, full=True)
+            events.extend(('write', record.path) for record in delta.new + delta.changed)
+            events.extend(('delete', record.path) for record in delta.deleted)
+        return events
+
+    def close(self):
+        self.snapshot.close()
+
+
+def make_watcher(walker, interval=2.0):
+    if InotifyWatcher.available():
+        try:
+            return InotifyWatcher(walker)
+        except OSError as ex:
+            logger.info(ex)
+    return PollingWatcher(walker, interval)
@@ -0,0 +1,87 @@
+from bisect import bisect_right
+
+from PySide6.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+
+class DuplicateGroupsModel(QAbstractTableModel):
+    """one row per file of a duplicate group, the keeper first
+
+    only the DuplicateFiles are stored, a row is found by bisecting the first-row offsets of the groups, so
+    millions of rows cost no per-row objects. rows are exposed to the view in FETCH_SIZE steps (fetchMore)
+    """
+    HEADERS = ['Group', 'Status', 'Size', 'Path']
+    FETCH_SIZE = 10000
+
+    def __init__(self, parent=None):
+        super(DuplicateGroupsModel, self).__init__(parent)
+        self.groups = []
+        self.offsets = []
+        self.total = 0
+        self.visible = 0
+
+    def add_groups(self, groups):
+        for group in groups:
+            self.groups.append(group)
+            self.offsets.append(self.total)
+            self.total += 1 + len(group.remove)
+        # a view scrolled to the end gets the new rows right away, otherwise fetchMore hands them out
+        if self.visible < self.FETCH_SIZE:
+            self.fetchMore(QModelIndex())
+
+    def clear(self):
+        self.beginResetModel()
+        self.groups = []
+        self.offsets = []
+        self.total = 0
+        self.visible = 0
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.visible
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.visible < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.total - self.visible, self.FETCH_SIZE)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.visible, self.visible + count - 1)
+        self.visible += count
+        self.endInsertRows()
+
+    def row(self, row):
+        # (group number, status, FileRecord) of a row
+        number = bisect_right(self.offsets, row) - 1
+        group = self.groups[number]
+        position = row - self.offsets[number]
+        if position == 0:
+            return number + 1, f'keep ({group.rule})', group.keep
+        return number + 1, 'similar' if group.report_only else 'remove', group.remove[position - 1]
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.TextAlignmentRole and index.column() in (0, 2):
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        if role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        number, status, record = self.row(index.row())
+        column = index.column()
+        if column == 0:
+            return number
+        if column == 1:
+            return status
+        if column == 2:
+            return f'{record.size:,}'
+        return record.path
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
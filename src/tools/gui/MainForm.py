@@ -1,45 +1,36 @@
-import ctypes
-import inspect
-import sys
-
 from loguru import logger
-from PySide6 import QtGui
 from PySide6.QtCore import QObject, Signal
-from PySide6.QtWidgets import QApplication, QFileDialog, QWidget
+from PySide6.QtWidgets import QFileDialog, QHeaderView, QWidget
 
+from ..core.checkpoint import DEFAULT_CHECKPOINT_PATH
 from ..core.duplicate_file_removal_tool import DuplicateFileRemoval
+from ..core.progress import ProgressReporter
+from .GroupsModel import DuplicateGroupsModel
 from .widgets.MainForm import Ui_Form_DFR
 
-
-def _async_raise(tid, exctype):
-    """raises the exception, performs cleanup if needed"""
-    tid = ctypes.c_long(tid)
-    if not inspect.isclass(exctype):
-        exctype = type(exctype)
-    res = ctypes.pythonapi.PyThreadState_SetAsyncExc(tid, ctypes.py_object(exctype))
-    if res == 0:
-        logger.info("Thread is already closed.")
-    elif res == 1:
-        logger.info("Thread is closed.")
-    else:
-        # """if it returns a number greater than one, you're in trouble,
-        # and you should call it again with exc=NULL to revert the effect"""
-        ctypes.pythonapi.PyThreadState_SetAsyncExc(tid, None)
-        logger.info("PyThreadState_SetAsyncExc failed")
+MB = 1024 * 1024
+PROGRESS_STEPS = 1000
 
 
-def stop_thread(thread):
-    _async_raise(thread.ident, SystemExit)
+class EngineEvents(QObject):
+    """worker thread callbacks as signals, Qt queues them into the GUI thread"""
+    log = Signal(str)
+    progress = Signal(object)
+    groups = Signal(object)
+    finished = Signal(object)
 
+    def reporter(self):
+        return ProgressReporter(self.progress.emit, self.groups.emit, self.finished.emit)
 
-class Stream(QObject):
-    _log = Signal(str)
 
-    def write(self, text):
-        self._log.emit(str(text))
-
-    def flush(self):
-        QApplication.processEvents()
+def format_progress(progress):
+    text = f'{progress.stage}: {progress.files:,}'
+    if progress.total_files:
+        text += f' / {progress.total_files:,}'
+    text += f' files, {progress.files_per_s:,.0f} files/s, {progress.bytes_per_s / MB:,.1f} MB/s'
+    if progress.eta is not None and not progress.done:
+        text += f', ETA {progress.eta:,.0f} s'
+    return text
 
 
 class MainForm(QWidget):
@@ -49,53 +40,98 @@ class MainForm(QWidget):
         self.gui = Ui_Form_DFR()
         self.gui.setupUi(self)
 
-        # Log
-        self.stream = Stream()
-        self.stream._log.connect(self.log)
+        self.worker = None
 
-        sys.stdout = self.stream
-        sys.stderr = self.stream
+        # Engine events
+        self.events = EngineEvents(self)
+        self.events.log.connect(self.log)
+        self.events.progress.connect(self.show_progress)
+        self.events.groups.connect(self.show_groups)
+        self.events.finished.connect(self.finished)
 
-        logger.add(self.stream, format="{time:YYYY-MM-DD HH:mm:ss} - {message}", level="INFO")
+        # Log, loguru calls the sink on the worker thread, the signal carries the line over
+        self.log_sink = logger.add(self.events.log.emit, format="{time:YYYY-MM-DD HH:mm:ss} - {message}", level="INFO")
 
         self.gui.textEdit_Log.document().setMaximumBlockCount(4096)
 
+        # Duplicate groups, fixed row heights so the view never measures rows it does not show
+        self.model = DuplicateGroupsModel(self)
+        self.gui.tableView_Groups.setModel(self.model)
+        self.gui.tableView_Groups.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.gui.tableView_Groups.verticalHeader().setDefaultSectionSize(self.fontMetrics().height() + 6)
+        for column, width in enumerate([60, 110, 110]):
+            self.gui.tableView_Groups.setColumnWidth(column, width)
+
         # Button
         self.gui.pushButton_Open.clicked.connect(self.open)
         self.gui.pushButton_Start.clicked.connect(self.start)
 
         logger.info('This tool will find and remove Duplicate Files')
         logger.info('1. find duplicate files by file size')
-        logger.info('2. find duplicate files by file md5 within 1st step results')
+        logger.info('2. find duplicate files by file hash (head, head + tail, full) within 1st step results')
         logger.info('3. keep the first file by create_date and modify_date, and remove other duplicate files')
         logger.info('The duplicate files will be moved to the Trash or Recycle Bin')
 
     def log(self, text):
-        if '\r' in text:
-            text = text.replace('\r', '').rstrip()
-            cursor = self.gui.textEdit_Log.textCursor()
-            # cursor.movePosition(QtGui.QTextCursor.End)
-            cursor.select(QtGui.QTextCursor.BlockUnderCursor)
-            cursor.removeSelectedText()
-            cursor.insertBlock()
-            self.gui.textEdit_Log.setTextCursor(cursor)
-
-        self.gui.textEdit_Log.insertPlainText(text)
-        self.gui.textEdit_Log.moveCursor(QtGui.QTextCursor.End)
+        self.gui.textEdit_Log.append(text.rstrip('\n'))
+
+    def show_progress(self, progress):
+        self.gui.label_Progress.setText(format_progress(progress))
+        bar = self.gui.progressBar
+        if progress.done:
+            bar.setRange(0, PROGRESS_STEPS)
+            bar.setValue(PROGRESS_STEPS)
+        elif progress.total_bytes:
+            bar.setRange(0, PROGRESS_STEPS)
+            bar.setValue(min(int(progress.bytes * PROGRESS_STEPS / progress.total_bytes), PROGRESS_STEPS))
+        elif progress.total_files:
+            bar.setRange(0, PROGRESS_STEPS)
+            bar.setValue(min(int(progress.files * PROGRESS_STEPS / progress.total_files), PROGRESS_STEPS))
+        else:
+            # unknown total (walking), busy indicator
+            bar.setRange(0, 0)
+
+    def show_groups(self, groups):
+        self.model.add_groups(groups)
+        self.gui.groupBox_Groups.setTitle(f'Duplicate Groups: {len(self.model.groups):,} ({self.model.total:,} files)')
+
+    def finished(self, error):
+        if error is not None:
+            logger.info(error)
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+        self.gui.pushButton_Start.setText('Start')
+        self.gui.pushButton_Start.setEnabled(True)
 
     def open(self):
-        self.path = QFileDialog.getExistingDirectory(self, 'Please Choose Source Dir', ".")
-        self.gui.lineEdit_Path.setText(self.path)
+        path = QFileDialog.getExistingDirectory(self, 'Please Choose Source Dir', ".")
+        if path:
+            self.gui.lineEdit_Path.setText(path)
 
     def start(self):
-
-        if len(self.path) <= 0:
+        if self.worker is not None:
+            # the worker stops at its next check (between files and groups), finished() resets the button
+            self.worker.stop()
+            self.gui.pushButton_Start.setText('Stopping')
+            self.gui.pushButton_Start.setEnabled(False)
+            return
+
+        path = self.gui.lineEdit_Path.text()
+        if len(path) <= 0:
             logger.info('Please Choose Source Dir at first')
-        else:
-            if self.gui.pushButton_Start.text() == 'Start':
-                self.worker = DuplicateFileRemoval(self.path)
-                self.worker.start()
-                self.gui.pushButton_Start.setText('Stop')
-            else:
-                stop_thread(self.worker)
-                self.gui.pushButton_Start.setText('Start')
+            return
+
+        self.model.clear()
+        self.gui.groupBox_Groups.setTitle('Duplicate Groups')
+        # a scan stopped here (or by a crash) continues where it left off when the same dir is started again
+        self.worker = DuplicateFileRemoval(path, progress=self.events.reporter(), checkpoint_path=DEFAULT_CHECKPOINT_PATH)
+        self.worker.start()
+        self.gui.pushButton_Start.setText('Stop')
+
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker.join()
+        logger.remove(self.log_sink)
+        QWidget.closeEvent(self, event)
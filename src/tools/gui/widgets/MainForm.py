@@ -12,8 +12,9 @@ from PySide6.QtCore import (QCoreApplication, QDate, QDateTime, QLocale, QMetaOb
                             QUrl)
 from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor, QFont, QFontDatabase, QGradient, QIcon, QImage,
                            QKeySequence, QLinearGradient, QPainter, QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QApplication, QGridLayout, QGroupBox, QHBoxLayout, QLayout, QLineEdit, QPushButton, QSizePolicy,
-                               QTextEdit, QVBoxLayout, QWidget)
+from PySide6.QtWidgets import (QAbstractItemView, QApplication, QGridLayout, QGroupBox, QHBoxLayout, QHeaderView, QLabel,
+                               QLayout, QLineEdit, QProgressBar, QPushButton, QSizePolicy, QTableView, QTextEdit, QVBoxLayout,
+                               QWidget)
 
 from ..resources.resource import *
 
@@ -60,6 +61,42 @@ class Ui_Form_DFR(object):
 
         self.verticalLayout.addLayout(self.horizontalLayout)
 
+        self.horizontalLayout_Progress = QHBoxLayout()
+        self.horizontalLayout_Progress.setObjectName(u"horizontalLayout_Progress")
+        self.progressBar = QProgressBar(Form_DFR)
+        self.progressBar.setObjectName(u"progressBar")
+        self.progressBar.setMaximum(1000)
+        self.progressBar.setValue(0)
+        self.progressBar.setTextVisible(False)
+
+        self.horizontalLayout_Progress.addWidget(self.progressBar)
+
+        self.label_Progress = QLabel(Form_DFR)
+        self.label_Progress.setObjectName(u"label_Progress")
+
+        self.horizontalLayout_Progress.addWidget(self.label_Progress)
+
+        self.horizontalLayout_Progress.setStretch(0, 2)
+        self.horizontalLayout_Progress.setStretch(1, 5)
+
+        self.verticalLayout.addLayout(self.horizontalLayout_Progress)
+
+        self.groupBox_Groups = QGroupBox(Form_DFR)
+        self.groupBox_Groups.setObjectName(u"groupBox_Groups")
+        self.gridLayout_Groups = QGridLayout(self.groupBox_Groups)
+        self.gridLayout_Groups.setObjectName(u"gridLayout_Groups")
+        self.tableView_Groups = QTableView(self.groupBox_Groups)
+        self.tableView_Groups.setObjectName(u"tableView_Groups")
+        self.tableView_Groups.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.tableView_Groups.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.tableView_Groups.setWordWrap(False)
+        self.tableView_Groups.horizontalHeader().setStretchLastSection(True)
+        self.tableView_Groups.verticalHeader().setVisible(False)
+
+        self.gridLayout_Groups.addWidget(self.tableView_Groups, 0, 0, 1, 1)
+
+        self.verticalLayout.addWidget(self.groupBox_Groups)
+
         self.groupBox_Log = QGroupBox(Form_DFR)
         self.groupBox_Log.setObjectName(u"groupBox_Log")
         self.gridLayout = QGridLayout(self.groupBox_Log)
@@ -74,6 +111,9 @@ class Ui_Form_DFR(object):
 
         self.verticalLayout.addWidget(self.groupBox_Log)
 
+        self.verticalLayout.setStretch(2, 3)
+        self.verticalLayout.setStretch(3, 2)
+
         self.retranslateUi(Form_DFR)
 
         QMetaObject.connectSlotsByName(Form_DFR)
@@ -84,6 +124,8 @@ class Ui_Form_DFR(object):
         Form_DFR.setWindowTitle(QCoreApplication.translate("Form_DFR", u"Duplicate File Removal Tool", None))
         self.pushButton_Open.setText(QCoreApplication.translate("Form_DFR", u"Open", None))
         self.pushButton_Start.setText(QCoreApplication.translate("Form_DFR", u"Start", None))
+        self.label_Progress.setText("")
+        self.groupBox_Groups.setTitle(QCoreApplication.translate("Form_DFR", u"Duplicate Groups", None))
         self.groupBox_Log.setTitle(QCoreApplication.translate("Form_DFR", u"Log", None))
 
     # retranslateUi
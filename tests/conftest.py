@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the packages live in src/, as when main.py / dfr.py are run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
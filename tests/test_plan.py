@@ -0,0 +1,79 @@
+import os
+
+import pytest
+
+from tools.core.plan import DedupPlan
+from tools.core.walker import FileRecord
+
+SIZE = 1000
+
+
+def record(path, ctime, mtime, ino):
+    return FileRecord(path, SIZE, ino, 1, mtime, ctime, int(mtime * 1e9))
+
+
+def test_plan_resolves_every_set_of_a_bucket():
+    # one size bucket, two duplicate sets and a file of its own
+    a1 = record('/t/a1', 3.0, 3.0, 1)
+    a2 = record('/t/a2', 1.0, 5.0, 2)
+    a3 = record('/t/a3', 2.0, 1.0, 3)
+    b1 = record('/t/b1', 4.0, 2.0, 4)
+    b2 = record('/t/b2', 4.0, 1.0, 5)
+    unique = record('/t/u', 0.0, 0.0, 6)
+
+    plan = DedupPlan('md5')
+    groups = {'a': [a1, a2, a3], 'b': [b1, b2], 'u': [unique]}
+    for digest, records in groups.items():
+        plan.add(records, digest)
+
+    assert [group.digest for group in plan.groups] == ['a', 'b']
+    group_a, group_b = plan.groups
+    assert group_a.keep == a2
+    assert group_a.remove == [a3, a1]
+    assert group_a.rule == 'ctime'
+    assert group_b.keep == b2
+    assert group_b.remove == [b1]
+    assert group_b.rule == 'mtime'
+    assert plan.remove_count == 3
+    assert plan.bytes_reclaimable == 3 * SIZE
+    assert plan.summary() == {'groups': 2, 'remove': 3, 'bytes_reclaimable': 3 * SIZE, 'unverified': 0}
+
+
+def test_plan_breaks_date_ties_by_path():
+    plan = DedupPlan('md5')
+    group = plan.add([record('/t/b', 1.0, 1.0, 1), record('/t/a', 1.0, 1.0, 2)], 'd')
+    assert group.keep.path == '/t/a'
+    assert [r.path for r in group.remove] == ['/t/b']
+    assert group.rule == 'path'
+
+
+def test_plan_duplicate_files_by_md5_covers_every_set(tmp_path):
+    pytest.importorskip('pandas')
+    from tools.core.duplicate_file_removal_tool import collect_file_info, plan_duplicate_files_by_md5
+
+    contents = {'a': os.urandom(SIZE), 'b': os.urandom(SIZE), 'u': os.urandom(SIZE)}
+    layout = {'a': ['a1', 'a2', 'a3'], 'b': ['b1', 'b2'], 'u': ['u']}
+    for name, file_names in layout.items():
+        for file_name in file_names:
+            (tmp_path / file_name).write_bytes(contents[name])
+
+    file_list = sorted(str(path) for path in tmp_path.iterdir())
+    plan = plan_duplicate_files_by_md5((SIZE, collect_file_info(file_list)))
+
+    def expected_keeper(file_names):
+        paths = [str(tmp_path / file_name) for file_name in file_names]
+        return min(paths, key=lambda path: (os.stat(path).st_ctime, os.stat(path).st_mtime, path))
+
+    assert len(plan.groups) == 2
+    by_size = {len(group.remove) + 1: group for group in plan.groups}
+    for name in ('a', 'b'):
+        group = by_size[len(layout[name])]
+        members = sorted([group.keep.path] + [r.path for r in group.remove])
+        assert members == sorted(str(tmp_path / file_name) for file_name in layout[name])
+        assert group.keep.path == expected_keeper(layout[name])
+        assert group.rule in ('ctime', 'mtime', 'path')
+        assert group.file_size == SIZE
+    assert str(tmp_path / 'u') not in {r.path for group in plan.groups for r in [group.keep] + group.remove}
+    assert plan.remove_count == 3
+    assert plan.bytes_reclaimable == 3 * SIZE
+    assert not plan.executed
@@ -0,0 +1,35 @@
+import os
+
+from tools.core.duplicate_file_removal_tool import DuplicateFileRemoval
+
+
+def scan(root, tmp_path, dry_run):
+    engine = DuplicateFileRemoval(str(root),
+                                  dry_run=dry_run,
+                                  action='unlink',
+                                  journal_path=str(tmp_path / 'journal.jsonl'),
+                                  snapshot_path=str(tmp_path / 'snapshot.db'))
+    engine.run()
+    return engine
+
+
+def test_dry_run_leaves_the_delta_to_the_next_run(tmp_path):
+    root = tmp_path / 'tree'
+    root.mkdir()
+    (root / 'a').write_bytes(b'x' * 5000)
+    (root / 'b').write_bytes(b'x' * 5000)
+
+    engine = scan(root, tmp_path, dry_run=True)
+    assert len(engine.delta.new) == 2
+    assert engine.removal_count == 1
+    assert sorted(os.listdir(root)) == ['a', 'b']
+
+    engine = scan(root, tmp_path, dry_run=False)
+    assert len(engine.delta.new) == 2
+    assert engine.removal_count == 1
+    assert len(os.listdir(root)) == 1
+
+    # acted on, the delta is recorded now
+    engine = scan(root, tmp_path, dry_run=False)
+    assert len(engine.delta.new) == 0
+    assert engine.removal_count is None
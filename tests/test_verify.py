@@ -0,0 +1,27 @@
+from tools.core.verify import compare_files
+
+
+def write(directory, name, data):
+    path = directory / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_compare_files_in_chunks_keeps_every_class(tmp_path):
+    a = [write(tmp_path, f'a{i}', b'a' * 10000) for i in range(7)]
+    b = [write(tmp_path, f'b{i}', b'b' * 10000) for i in range(3)]
+
+    # at most 4 open files: the first round compares a0 with three chunks, b is the only class left after it
+    classes = compare_files(a + b, block_size=4096, max_open=4)
+    assert sorted(sorted(members) for members in classes) == [sorted(a), sorted(b)]
+
+    unique = write(tmp_path, 'u', b'a' * 9999 + b'u')
+    classes = compare_files([unique] + b + a, block_size=4096, max_open=4)
+    assert sorted(sorted(members) for members in classes) == [sorted(a), sorted(b)]
+
+
+def test_compare_files_in_one_chunk(tmp_path):
+    a = [write(tmp_path, f'a{i}', b'a' * 100) for i in range(2)]
+    b = [write(tmp_path, f'b{i}', b'b' * 100) for i in range(2)]
+    classes = compare_files(b + a)
+    assert sorted(sorted(members) for members in classes) == [sorted(a), sorted(b)]